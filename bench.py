@@ -0,0 +1,144 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+"""
+End-to-end benchmark of the bot against fakereddit, nothing leaves the machine.
+
+    python bench.py --sizes 30 100 1000 10000 --comments 5 --latency 0.05
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+import fakereddit
+import main
+import notify
+
+def run_phase(name: str, callback, reddit: fakereddit.FakeReddit, sink: fakereddit.FakeWebhookSink, memory: bool):
+    """Runs one phase and measures it
+
+    Args:
+        name (str): Name of the phase
+        callback: The phase
+        reddit (fakereddit.FakeReddit): The fake, for counting API calls
+        sink (fakereddit.FakeWebhookSink): The webhook sink, for counting Discord messages
+        memory (bool): Whether to track the peak memory
+
+    Returns:
+        dict: The measurements
+    """
+    gc.collect()
+    if memory:
+        tracemalloc.reset_peak()
+
+    calls = sum(reddit.calls.values())
+    messages = len(sink.messages)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+
+    callback()
+
+    return {
+        "phase": name,
+        "wall_s": time.perf_counter() - wall,
+        "cpu_s": time.process_time() - cpu,
+        "api_calls": sum(reddit.calls.values()) - calls,
+        "discord_messages": len(sink.messages) - messages,
+        "peak_mb": tracemalloc.get_traced_memory()[1] / 2 ** 20 if memory else None
+    }
+
+def bench_size(posts: int, comments: int, latency: float, memory: bool):
+    """Benchmarks every phase of a run against a fake subreddit with posts drafts
+
+    Args:
+        posts (int): Drafts in the fake subreddit
+        comments (int): Comments per draft
+        latency (float): Simulated seconds per API call
+        memory (bool): Whether to track the peak memory
+
+    Returns:
+        list: Measurements per phase
+    """
+    reddit = fakereddit.FakeReddit(latency)
+    sink = fakereddit.FakeWebhookSink()
+
+    fakereddit.generate(reddit, "srotd_dev", posts, comments)
+    reddit.add_submission("srotd_dev", "Schedule", "Our schedule\n", id = main.update_post_id)
+
+    handler = None
+    results = []
+
+    def startup():
+        nonlocal handler
+        notify.get_queue(main.discord_webhook, sender = sink)
+        handler = main.Reddit_Handler(reddit)
+
+    results.append(run_phase("startup", startup, reddit, sink, memory))
+    results.append(run_phase("ingest", lambda: handler.tsrotd.check_for_new_posts(limit = posts), reddit, sink, memory))
+    results.append(run_phase("rescan", lambda: handler.tsrotd.check_for_new_posts(limit = posts), reddit, sink, memory))
+    results.append(run_phase("schedule", handler.tsrotd.create_schedule, reddit, sink, memory))
+    results.append(run_phase("posting", handler.tsrotd.post.send_post, reddit, sink, memory))
+    results.append(run_phase("exit", handler.exit, reddit, sink, memory))
+
+    for result in results:
+        result["posts"] = posts
+
+    return results
+
+def main_bench():
+    parser = argparse.ArgumentParser(description = "Offline benchmark of the SROTD Schedule Bot")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [30, 100, 1000, 10000], help = "amounts of drafts to benchmark")
+    parser.add_argument("--comments", type = int, default = 5, help = "comments per draft")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "simulated seconds per API call")
+    parser.add_argument("--no-memory", action = "store_true", help = "don't track peak memory, tracemalloc slows everything down")
+    parser.add_argument("--json", help = "also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.WARNING, format = "%(asctime)s [%(levelname)s] %(message)s")
+
+    # Nothing leaves the process, so the PROD code paths can be measured as well
+    main.DEV = False
+
+    memory = not args.no_memory
+    if memory:
+        tracemalloc.start()
+
+    results = []
+    cwd = os.getcwd()
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                results += bench_size(size, args.comments, args.latency, memory)
+            finally:
+                os.chdir(cwd)
+
+    print(f"{'posts':>6} {'phase':<9} {'wall s':>9} {'cpu s':>9} {'api':>6} {'discord':>7} {'peak MB':>8}")
+    for result in results:
+        peak = f"{result['peak_mb']:8.1f}" if result["peak_mb"] != None else f"{'-':>8}"
+        print(f"{result['posts']:>6} {result['phase']:<9} {result['wall_s']:9.3f} {result['cpu_s']:9.3f} "
+              f"{result['api_calls']:>6} {result['discord_messages']:>7} {peak}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent = 2)
+
+if __name__ == "__main__":
+    main_bench()
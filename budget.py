@@ -0,0 +1,146 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+import enum
+import logging
+import threading
+import time
+
+import metrics
+
+# Length of reddit's rate limit window in seconds
+WINDOW = 600
+
+class Priority(enum.IntEnum):
+    """
+    Lower values win, posting is never deferred for anything else
+    """
+    POSTING = 0
+    PUBLISH = 1
+    INGEST = 2
+    BACKFILL = 3
+
+class Budgeter:
+    """
+    Splits reddit's rate limit window between the duties of the bot.
+
+    Every priority but posting keeps a reserve of requests untouched for the ones
+    above it, work that would dig into its reserve is deferred to a later run.
+    The numbers come from the rate limit headers praw tracks in reddit.auth.limits.
+    Newer praw versions only keep remaining and used there, the end of the window
+    then comes from the x-ratelimit-reset header metrics records, or failing that
+    is assumed to be a whole window after the numbers last changed. Numbers from
+    a window that is over count as unknown. Waiting for the window to reset ends
+    early once stopping is set.
+    """
+    def __init__(self, reddit: "praw.Reddit", reserves: dict, stopping: threading.Event = None):
+        self.reddit = reddit
+        self.stopping = stopping if stopping != None else threading.Event()
+        self.reserves = {Priority.POSTING: 0}
+        self.reserves.update({Priority[name.upper()]: reserve for name, reserve in reserves.items()})
+
+        self.seen = None # remaining and used as last read from reddit.auth.limits
+        self.seen_at = None
+
+    def remaining(self):
+        """
+        Requests left in the current window, None if unknown or the window is over
+        """
+        limits = self.reddit.auth.limits
+
+        if (remaining := limits.get("remaining")) == None:
+            return None
+        if self.reset_timestamp() <= time.time():
+            return None
+
+        return int(remaining)
+
+    def affordable(self, priority: Priority):
+        """Returns how many requests work of a priority may still make
+
+        Args:
+            priority (Priority): Priority of the work
+
+        Returns:
+            None or int: None when there is no known limit
+        """
+        if (remaining := self.remaining()) == None:
+            return None
+
+        return max(0, remaining - self.reserves.get(priority, 0))
+
+    def allow(self, priority: Priority, cost: int, what: str):
+        """Decides whether work may run now
+
+        Args:
+            priority (Priority): Priority of the work
+            cost (int): Requests the work is expected to make
+            what (str): Name of the work for the log
+
+        Returns:
+            bool: False if the work should be deferred
+        """
+        if (affordable := self.affordable(priority)) == None or cost <= affordable:
+            return True
+
+        logging.warning(f"Deferring {what} ({priority.name.lower()}): needs {cost} requests but only {affordable} of "
+                        f"{self.remaining()} left aren't reserved, window resets in {self.reset_in():.0f}s")
+        metrics.count(f"budget_deferred_{priority.name.lower()}")
+
+        return False
+
+    def reset_timestamp(self):
+        """
+        When the rate limit window of the current numbers ends
+        """
+        limits = self.reddit.auth.limits
+
+        if (reset := limits.get("reset_timestamp")) != None:
+            return reset
+
+        # Recorded from the same responses praw takes the numbers from
+        if (reset := metrics.gauge_value("reddit_ratelimit_reset_timestamp")) != None:
+            return reset
+
+        seen = (limits.get("remaining"), limits.get("used"))
+        if seen != self.seen:
+            self.seen = seen
+            self.seen_at = time.time()
+
+        return self.seen_at + WINDOW
+
+    def reset_in(self):
+        """
+        Seconds until the rate limit window resets
+        """
+        return max(0.0, self.reset_timestamp() - time.time())
+
+    def wait_for_reset(self, what: str):
+        """Sleeps until the rate limit window resets, only for work that can't be deferred
+
+        Args:
+            what (str): Name of the work for the log
+
+        Returns:
+            bool: False if the bot is stopping and the work should be dropped
+        """
+        seconds = self.reset_in()
+
+        logging.warning(f"Waiting {seconds:.0f}s for the rate limit window to reset before {what}")
+        metrics.count("budget_waits")
+
+        if self.stopping.wait(seconds + 1):
+            logging.info(f"Stopping, giving up on {what}")
+            return False
+
+        return True
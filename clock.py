@@ -0,0 +1,91 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+"""
+The time the bot lives in.
+
+Scheduling and posting ask this module instead of datetime.datetime.now() and
+time.time(), so simulate.py can fast-forward through a year without waiting.
+Durations (metrics, timeouts) keep using the real clocks.
+"""
+
+import datetime
+import time
+
+class SystemClock:
+    def now(self):
+        return datetime.datetime.now()
+
+    def timestamp(self):
+        return time.time()
+
+class FakeClock:
+    """
+    Stands still until it is moved with advance or set
+    """
+    def __init__(self, start: datetime.datetime):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def timestamp(self):
+        return self.current.timestamp()
+
+    def advance(self, **kwargs):
+        self.current += datetime.timedelta(**kwargs)
+
+    def set(self, when: datetime.datetime):
+        self.current = when
+
+_clock = SystemClock()
+
+def now():
+    """Returns the current local time
+
+    Returns:
+        datetime.datetime: Naive local time, like datetime.datetime.now()
+    """
+    return _clock.now()
+
+def today():
+    """Returns the current local date
+
+    Returns:
+        datetime.date: Like datetime.date.today()
+    """
+    return _clock.now().date()
+
+def timestamp():
+    """Returns the current unix timestamp
+
+    Returns:
+        float: Like time.time()
+    """
+    return _clock.timestamp()
+
+def use(clock):
+    """Replaces the clock everything reads the time from
+
+    Args:
+        clock (SystemClock or FakeClock): The new clock
+
+    Returns:
+        SystemClock or FakeClock: The previous clock, to restore it later
+    """
+    global _clock
+
+    previous = _clock
+    _clock = clock
+
+    return previous
@@ -4,4 +4,59 @@ password = "PASSWORD"
 username = "USERNAME"
 update_post_id = "ID"
 DEV = True
-discord_webhook = "WEBHOOK_URL"
\ No newline at end of file
+discord_webhook = "WEBHOOK_URL"
+
+# How many days ahead the schedule is planned
+SCHEDULE_DAYS = 30
+
+# Where the db lives, "sqlite" or "json" - an existing db.json is migrated into a new SQLite db
+STORE_BACKEND = "sqlite"
+STORE_FILE = "db.sqlite3"
+BLOB_DIR = "blobs" # Compressed post bodies, the db only keeps a preview and their hash
+
+# Intervals in seconds for the duties of "main.py --daemon"
+SCAN_INTERVAL = 5 * 60
+SCHEDULE_INTERVAL = 15 * 60
+POST_CHECK_INTERVAL = 60
+CHECKPOINT_INTERVAL = 5 * 60
+STREAM_INTERVAL = 30 # New [date] / [title] / [full] comments
+
+# How many comment trees are fetched at once, at most 8. They share one reddit session whose rate
+# limiter isn't thread safe, so when the window runs low they fetch one at a time again
+FETCH_WORKERS = 8
+
+# Unchanged submissions are skipped by the scans for at most this many hours, edited comments are only
+# noticed by the next full scan. None only rescans them on December 1st and January 1st for the year of their date
+FINGERPRINT_HOURS = 6
+
+# Per-run metrics, a JSON summary and optionally a file for the node_exporter textfile collector.
+# --job and --backfill runs write their own files next to these (metrics.ingest.json, srotd.ingest.prom, ...),
+# their series carry a run label
+METRICS_JSON = "metrics.json"
+METRICS_PROM = None # e.g. "/var/lib/node_exporter/textfile_collector/srotd.prom"
+
+# Requests of reddit's rate limit window that lower priorities leave to the higher ones
+# (posting > publish > ingest > backfill), work that would need them is deferred
+BUDGET_RESERVES = {"publish": 10, "ingest": 60, "backfill": 150}
+
+# Several communities run by one bot, sharing the login, connection pool and rate limit budget.
+# Every tenant keeps its own db, schedule post and Discord queue; None runs the single community
+# described by the settings above. Tenants with the same webhook share one queue.
+# TENANTS = [
+#     {"name": "srotd", "drafts": "srotd_dev", "target": "subredditoftheday", "schedule_post": "ID",
+#      "webhook": "WEBHOOK_URL", "db": "db.sqlite3", "legacy_json": "db.json", "queue": "discord_queue.json"},
+#     {"name": "other", "drafts": "other_drafts", "target": "otheroftheday", "schedule_post": "ID",
+#      "webhook": "WEBHOOK_URL", "db": "other.sqlite3"}
+# ]
+TENANTS = None
+
+# Logging goes through a background writer, the log file rolls over at LOG_ROTATE_WHEN
+# and whenever it grows past LOG_MAX_BYTES (0 to only roll over by time)
+LOG_FILE = "debug.log"
+LOG_MAX_BYTES = 20 * 1024 * 1024
+LOG_ROTATE_WHEN = "midnight"
+LOG_BACKUPS = 14
+LOG_MESSAGE_LIMIT = 1000 # Longer messages are cut, tracebacks are kept whole
+
+# Read-only JSON status API of "main.py --daemon" on 127.0.0.1, None to turn it off
+STATUS_PORT = None # e.g. 8787
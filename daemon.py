@@ -0,0 +1,69 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+import logging
+import signal
+import threading
+import time
+
+class Task:
+    """
+    A duty of the daemon that runs every interval seconds
+    """
+    def __init__(self, name: str, interval: float, callback):
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.next_run = 0.0
+
+    def run(self):
+        start = time.monotonic()
+
+        try:
+            self.callback()
+        except Exception:
+            # A failed run (network, API, ...) must not take the whole daemon down
+            logging.exception(f"Task {self.name} failed, retrying in {self.interval}s")
+
+        logging.debug(f"Task {self.name} took {time.monotonic() - start:.2f}s")
+        self.next_run = time.monotonic() + self.interval
+
+class Daemon:
+    """
+    Runs tasks at their own cadence until SIGTERM / SIGINT, then calls shutdown once.
+    """
+    def __init__(self, tasks: list, shutdown, stopping: threading.Event = None):
+        self.tasks = tasks
+        self.shutdown = shutdown
+        self.stopping = stopping if stopping != None else threading.Event() # Shared with waits inside the tasks
+
+    def stop(self, signum = None, frame = None):
+        logging.info(f"Received signal {signum}, shutting down")
+        self.stopping.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        try:
+            while not self.stopping.is_set():
+                for task in self.tasks:
+                    if self.stopping.is_set():
+                        break
+                    if task.next_run <= time.monotonic():
+                        task.run()
+
+                next_run = min(task.next_run for task in self.tasks)
+                self.stopping.wait(max(0.0, next_run - time.monotonic()))
+        finally:
+            self.shutdown()
@@ -0,0 +1,285 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+"""
+Offline stand-in for the parts of praw (and the Discord webhook) the bot uses.
+
+Every call that would hit the network is counted in FakeReddit.calls and
+can be slowed down by a fixed latency to mimic round-trips.
+"""
+
+import collections
+import datetime
+import random
+import threading
+import time
+
+import clock
+
+class FakeRedditor:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+class FakeComment:
+    def __init__(self, reddit: "FakeReddit", id: str, body: str, created_utc: float, submission: "FakeSubmission" = None):
+        self.reddit = reddit
+        self.id = id
+        self.body = body
+        self.created_utc = created_utc
+        self.submission = submission
+        self.link_id = f"t3_{submission.id}" if submission != None else None
+        self.author = FakeRedditor("commenter")
+
+    def edit(self, body: str):
+        self.reddit.call("edit")
+        self.body = body
+
+    def delete(self):
+        self.reddit.call("delete")
+        self.reddit.comments.pop(self.id, None)
+
+class FakeCommentForest(list):
+    def __init__(self, reddit: "FakeReddit", comments: list):
+        super().__init__(comments)
+        self.reddit = reddit
+
+    def replace_more(self, limit: int = 32):
+        return []
+
+    def list(self):
+        return list(self)
+
+class FakeSubmission:
+    def __init__(self, reddit: "FakeReddit", subreddit: "FakeSubreddit", id: str, title: str, selftext: str = "",
+                 link_flair_text: str = None, author: str = "writer", created_utc: float = None, url: str = None):
+        self.reddit = reddit
+        self.subreddit = subreddit
+        self.id = id
+        self.name = f"t3_{id}"
+        self.title = title
+        self.selftext = selftext
+        self.link_flair_text = link_flair_text
+        self.author = FakeRedditor(author)
+        self.created_utc = created_utc if created_utc != None else clock.timestamp()
+        self.url = url
+        self.removed = False
+        self.edited = False
+        self.permalink = f"/r/{subreddit.display_name}/comments/{id}/"
+        self._comments = []
+
+    @property
+    def num_comments(self):
+        return len(self._comments)
+
+    @property
+    def comments(self):
+        self.reddit.call("comments")
+        return FakeCommentForest(self.reddit, self._comments)
+
+    def add_comment(self, body: str, created_utc: float = None):
+        comment = FakeComment(self.reddit, self.reddit.next_id(), body,
+                              created_utc if created_utc != None else clock.timestamp(), self)
+        self._comments.append(comment)
+        self.reddit.comments[comment.id] = comment
+        return comment
+
+    def edit(self, body: str):
+        self.reddit.call("edit")
+        self.selftext = body
+        self.edited = clock.timestamp()
+
+    def reply(self, body: str):
+        self.reddit.call("reply")
+        return self.add_comment(body)
+
+class FakeSubreddit:
+    def __init__(self, reddit: "FakeReddit", display_name: str):
+        self.reddit = reddit
+        self.display_name = display_name
+        self.submissions = [] # Oldest first
+
+    def __str__(self):
+        return self.display_name
+
+    def listing(self, items: list, limit: int, params: dict = None):
+        """
+        Newest first, one counted request per page of 100 like reddit's listings
+        """
+        params = params or {}
+        items = sorted(items, key = lambda x: x.created_utc, reverse = True)
+
+        if (after := params.get("after")) != None:
+            names = [getattr(item, "name", None) for item in items]
+            items = items[names.index(after) + 1:] if after in names else []
+
+        if limit != None:
+            items = items[:limit]
+
+        for i, item in enumerate(items):
+            if i % 100 == 0:
+                self.reddit.call("listing")
+            yield item
+
+        if len(items) == 0:
+            self.reddit.call("listing")
+
+    def new(self, limit: int = 100, params: dict = None):
+        return self.listing(self.submissions, limit, params)
+
+    def comments(self, limit: int = 100, params: dict = None):
+        return self.listing([comment for submission in self.submissions for comment in submission._comments], limit, params)
+
+    def submit(self, title: str, selftext: str = None, url: str = None, **kwargs):
+        self.reddit.call("submit")
+        return self.reddit.add_submission(self.display_name, title, selftext or "", url = url)
+
+class FakeUser:
+    def __init__(self, name: str):
+        self.name = name
+
+    def me(self):
+        return FakeRedditor(self.name)
+
+class FakeAuth:
+    def __init__(self):
+        self.limits = {"remaining": None, "reset_timestamp": None, "used": None}
+
+class FakeReddit:
+    """
+    Implements the praw.Reddit surface used by main.py in memory
+    """
+    def __init__(self, latency: float = 0.0, username: str = "r_tomBOT"):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+        self.subreddits = {}
+        self.submissions = {}
+        self.comments = {}
+        self.user = FakeUser(username)
+        self.auth = FakeAuth()
+        self.validate_on_submit = False
+        self.counter = 36 ** 5 # Six digit ids like reddit's
+
+    def call(self, endpoint: str):
+        with self.lock:
+            self.calls[endpoint] += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def next_id(self):
+        with self.lock:
+            self.counter += 1
+            counter = self.counter
+
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+        id = ""
+        while counter > 0:
+            counter, rest = divmod(counter, 36)
+            id = digits[rest] + id
+        return id
+
+    def subreddit(self, name: str):
+        if not name in self.subreddits.keys():
+            self.subreddits[name] = FakeSubreddit(self, name)
+        return self.subreddits[name]
+
+    def add_submission(self, subreddit: str, title: str, selftext: str = "", id: str = None, **kwargs):
+        sub = self.subreddit(subreddit)
+        submission = FakeSubmission(self, sub, id or self.next_id(), title, selftext, **kwargs)
+        sub.submissions.append(submission)
+        self.submissions[submission.id] = submission
+        return submission
+
+    def submission(self, id: str):
+        self.call("submission")
+
+        if not id in self.submissions.keys():
+            # Behaves like a deleted post
+            return FakeSubmission(self, self.subreddit("deleted"), id, "[deleted]")
+        return self.submissions[id]
+
+    def comment(self, id: str):
+        return self.comments[id]
+
+    def info(self, fullnames: list):
+        fullnames = list(fullnames)
+
+        for i in range(0, len(fullnames), 100):
+            self.call("info")
+
+            for fullname in fullnames[i:i + 100]:
+                if (submission := self.submissions.get(fullname[3:])) != None:
+                    yield submission
+
+class FakeWebhookSink:
+    """
+    Stands in for notify.send_webhook, collects every message instead of sending it
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.messages = []
+
+    def __call__(self, webhook_url: str, embeds: list):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        self.messages.append(list(embeds))
+        return True, None
+
+def generate(reddit: FakeReddit, subreddit: str, posts: int, comments: int, seed: int = 0):
+    """Fills a subreddit with synthetic drafts like the ones our writers post
+
+    Args:
+        reddit (FakeReddit): The fake
+        subreddit (str): The drafts subreddit
+        posts (int): How many submissions
+        comments (int): Comments per submission, some of them carry [date] / [title] / [full] tags
+        seed (int): Seed for reproducible data
+
+    Returns:
+        list: The submissions
+    """
+    rng = random.Random(seed)
+    start = clock.now()
+    flairs = ["BOT READY"] * 6 + ["EMERGENCY READY", "WORK IN PROGRESS", None, None]
+    created = clock.timestamp() - posts * 60
+    generated = []
+
+    for i in range(posts):
+        date = start + datetime.timedelta(days = rng.randrange(1, 365))
+        title_date = rng.choice([f"{date.strftime('%B')} {date.day}", f"{date.day}.{date.month}.", ""])
+        submission = reddit.add_submission(subreddit, f"r/sub{i}: {title_date}",
+                                           "Lorem ipsum dolor sit amet. " * rng.randrange(20, 200),
+                                           link_flair_text = rng.choice(flairs), author = f"writer{i % 25}",
+                                           created_utc = created + i * 60)
+
+        for j in range(comments):
+            kind = rng.random()
+            if kind < 0.2:
+                body = f"[date] {date.day}.{date.month}."
+            elif kind < 0.3:
+                body = f"[title] r/sub{i}: The best subreddit number {i}"
+            elif kind < 0.35:
+                body = f"[full] r/sub{i}: Everything at once on {date.strftime('%B')} {date.day}"
+            else:
+                body = "Looks great, maybe fix the second paragraph?"
+
+            submission.add_comment(body, submission.created_utc + j)
+
+        generated.append(submission)
+
+    return generated
@@ -12,8 +12,39 @@
 ###
 
 import datetime
+import hashlib
+import json
 import logging
-import dateparser.search
+import importlib
+import os
+import re
+import sys
+import time
+
+import clock
+import metrics
+import store
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+
+_MONTH = r"(?P<month>jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?"
+_DAY = r"(?P<day>\d{1,2})(?:st|nd|rd|th)?"
+_YEAR = r"(?:,?\s+(?P<year>\d{4}))?"
+
+# Formats our editors actually use, tried before falling back to dateparser
+FAST_DATE_PATTERNS = (
+    re.compile(r"\b(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b"),                # 2024-03-03
+    re.compile(r"\b" + _MONTH + r"\s+" + _DAY + r"\b" + _YEAR, re.IGNORECASE),               # March 3rd, 2024
+    re.compile(r"\b" + _DAY + r"\s+(?:of\s+)?" + _MONTH + r"(?!\w)" + _YEAR, re.IGNORECASE), # 3rd of March 2024
+    re.compile(r"(?<![\d.])(?P<day>\d{1,2})\.(?P<month>\d{1,2})\.(?P<year>\d{4})?(?![\d.])"), # 3.3. / 3.3.2024
+)
+
+DATE_LANGUAGES = ["en"]
+
+_date_cache = {}
 
 def check_if_date_valid(date: datetime.datetime):
     """Checks whether the datetime has at least a valid day and month
@@ -38,7 +69,7 @@ def find_year_by_datetime(date: datetime.datetime):
     Returns:
         int: year
     """
-    now = datetime.datetime.now()
+    now = clock.now()
     
     if (year := date.year) == None: # If no year was provided, year is likely this year
         year = now.year
@@ -46,41 +77,115 @@ def find_year_by_datetime(date: datetime.datetime):
         year += 1
     return year
 
+def fast_parse_date_from_string(string: str):
+    """Looks for the first date in one of the formats in FAST_DATE_PATTERNS
+
+    Args:
+        string (str): String to search on
+
+    Returns:
+        None or Datetime: Depending on success
+    """
+    best = None
+    
+    for pattern in FAST_DATE_PATTERNS:
+        if (match := pattern.search(string)) != None \
+        and (best == None or match.start() < best.start()):
+            best = match
+    
+    if best == None:
+        return None
+    
+    month = best.group("month")
+    month = int(month) if month.isdigit() else MONTHS[month[:3].lower()]
+    year = int(best.group("year")) if best.group("year") else clock.now().year
+    
+    try:
+        return datetime.datetime(year, month, int(best.group("day")))
+    except ValueError:
+        return None
+
+@metrics.timed("parse_date")
 def parse_date_from_string(string: str):
     """Tries to find dates in a longer string
 
+    Results are memoized by the normalized string for the rest of the day, see load_date_cache.
+
     Args:
         string (str): String to search on
 
     Returns:
         None or Datetime: Depending on success 
     """
-    data = dateparser.search.search_dates(string)
+    key = " ".join(string.lower().split())
+    today = clock.today().isoformat()
     
-    if data == None:
-        return None
+    if (cached := _date_cache.get(key)) != None and cached["parsed_on"] == today:
+        metrics.count("date_cache_hits")
+        return datetime.datetime.fromisoformat(cached["date"]) if cached["date"] != None else None
     
-    if len(data) > 1:
-        logging.error("Amount of dates was more than one - For some reason ...")
+    if (date := fast_parse_date_from_string(string)) == None:
+        import dateparser.search # Expensive, only loaded when the fast path fails
         
-    return data[0][1]
+        metrics.count("date_dateparser_calls")
+        
+        data = dateparser.search.search_dates(string, languages = DATE_LANGUAGES)
+        
+        if data != None:
+            if len(data) > 1:
+                logging.error("Amount of dates was more than one - For some reason ...")
+            
+            date = data[0][1]
+    
+    _date_cache[key] = {
+        "parsed_on": today,
+        "date": date.isoformat() if date != None else None
+    }
+    
+    return date
+
+def load_date_cache(filename: str):
+    """Loads the memoized results of parse_date_from_string
+
+    Args:
+        filename (str): The cache file
+    """
+    try:
+        with open(filename, "r") as file:
+            _date_cache.update(json.load(file))
+    except (OSError, ValueError) as e:
+        logging.warning(f"Error opening date cache: {e} - Starting with an empty cache")
+
+def save_date_cache(filename: str):
+    """Saves the memoized results of parse_date_from_string, dropping the ones from previous days
+
+    Args:
+        filename (str): The cache file
+    """
+    today = clock.today().isoformat()
+    
+    for key in [key for key, value in _date_cache.items() if value["parsed_on"] != today]:
+        _date_cache.pop(key)
+    
+    with store.replacing(filename, sync = False) as file:
+        json.dump(_date_cache, file)
 
 def parse_date(date: datetime.date):
-    """Parses dates from a datetime into a dictionary
+    """Moves a parsed date into the year it will be posted in
 
     Args:
         date (datetime.date): Date
 
     Returns:
-        dict: Dictionary with dates as strings
+        datetime.date: The date in the year found by find_year_by_datetime
     """
-    db_dt = {}
-    
-    db_dt["day"] = date.day
-    db_dt["month"] = date.month
-    db_dt["year"] = find_year_by_datetime(date)
+    year = find_year_by_datetime(date)
     
-    return db_dt
+    try:
+        return datetime.date(year, date.month, date.day)
+    except ValueError:
+        # February 29th in a year without one
+        return datetime.date(date.year, date.month, date.day)
 
 def output_good_post_date_str():
     """Returns a formatted date in the style of the subreddit titles
@@ -88,7 +193,7 @@ def output_good_post_date_str():
     Returns:
         str: Formatted datestring
     """
-    date = datetime.datetime.now()
+    date = clock.now()
     
     endings = {
         1: "st",
@@ -101,4 +206,56 @@ def output_good_post_date_str():
     month = date.strftime("%B")
     str_date = f"{month} {str(date.day)}{ending}, {str(date.year)}"
     
-    return str_date
\ No newline at end of file
+    return str_date
+
+def submission_fingerprint(submission, hours: int = 6):
+    """Builds a fingerprint of everything on a submission the bot parses
+
+    Edited comments don't show up on the submission, so the fingerprint also expires
+    every hours hours. The year a date falls into (see find_year_by_datetime) only
+    depends on the year and on whether it is December, so those are part of it too.
+
+    Args:
+        submission (praw.models.Submission): The submission
+        hours (None or int): How long an unchanged submission may be skipped, None until the year rollover
+
+    Returns:
+        str: Hex digest that changes whenever the submission needs a rescan
+    """
+    text_hash = hashlib.sha256(submission.selftext.encode("utf-8")).hexdigest()
+    now = clock.now()
+    
+    parts = (
+        now.year,
+        now.month == 12,
+        int(clock.timestamp() // (hours * 3600)) if hours != None else None,
+        submission.title,
+        submission.link_flair_text,
+        submission.edited,
+        submission.num_comments,
+        submission.removed,
+        text_hash
+    )
+    
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+def measure_imports(modules: tuple):
+    """Imports modules one after another and measures how long each import took
+
+    Modules that were already imported by an earlier one are reported as (nearly) free.
+
+    Args:
+        modules (tuple): Names of the modules
+
+    Returns:
+        list: (module, seconds) tuples
+    """
+    timings = []
+    
+    for module in modules:
+        start = time.perf_counter()
+        if module not in sys.modules:
+            importlib.import_module(module)
+        timings.append((module, time.perf_counter() - start))
+    
+    return timings
\ No newline at end of file
@@ -0,0 +1,117 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+"""
+Logging that stays off the critical path.
+
+Callers only put records into a bounded queue, a listener thread formats them and
+writes the log file and the console. Messages are cut to a maximum length before
+they are queued, the log file rolls over daily and whenever it gets too big.
+"""
+
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+
+import metrics
+
+FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without blocking, long messages are cut and records are dropped when the queue is full
+    """
+    def __init__(self, log_queue: queue.Queue, limit: int):
+        super().__init__(log_queue)
+        self.limit = limit
+
+    def prepare(self, record: logging.LogRecord):
+        message = record.getMessage()
+
+        # Tracebacks are added later on and kept whole
+        if self.limit > 0 and len(message) > self.limit:
+            record = copy.copy(record)
+            record.msg = f"{message[:self.limit]} ... [{len(message) - self.limit} more characters]"
+            record.args = None
+
+        return super().prepare(record)
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.count("log_records_dropped")
+
+class RotatingLogHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+    Rolls the log over at the given time and in between whenever it grows past max_bytes
+    """
+    def __init__(self, filename: str, max_bytes: int, when: str = "midnight", backup_count: int = 14):
+        super().__init__(filename, when = when, backupCount = backup_count, encoding = "utf-8", delay = True)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record: logging.LogRecord):
+        if super().shouldRollover(record):
+            return True
+
+        if self.max_bytes <= 0:
+            return False
+
+        if self.stream == None:
+            self.stream = self._open()
+
+        return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+
+    def rotation_filename(self, default_name: str):
+        # Several size rollovers on one day get numbered instead of replacing each other
+        name = default_name
+        number = 1
+
+        while os.path.exists(name):
+            name = f"{default_name}.{number:03d}"
+            number += 1
+
+        return name
+
+def setup(level: int, filename: str, max_bytes: int, when: str, backup_count: int, limit: int, queue_size: int = 10000):
+    """Routes all logging through a queue to the log file and the console
+
+    Args:
+        level (int): Lowest level that is logged
+        filename (str): The log file
+        max_bytes (int): Size at which the log file rolls over, 0 for only time based rollovers
+        when (str): When the log file rolls over, see logging.handlers.TimedRotatingFileHandler
+        backup_count (int): How many old log files are kept
+        limit (int): Longest message in characters, 0 for no limit
+        queue_size (int): Records waiting to be written before new ones are dropped
+
+    Returns:
+        logging.handlers.QueueListener: The writer, stop it to flush everything before exiting
+    """
+    formatter = logging.Formatter(FORMAT)
+    handlers = [RotatingLogHandler(filename, max_bytes, when, backup_count), logging.StreamHandler()]
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(queue_size)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level = True)
+
+    logging.root.handlers = [TruncatingQueueHandler(log_queue, limit)]
+    logging.root.setLevel(level)
+
+    listener.start()
+
+    return listener
@@ -11,129 +11,355 @@
 # See the Licence for the specific language governing permissions and limitations under the Licence.
 ###
 
-import praw
-import json
+import argparse
+import concurrent.futures
+import functools
 import os
+import random
 import sys
-import dateparser
+import threading
 import logging
 import datetime
 import re
 import enum
+import hashlib
+import typing
 
-import praw.exceptions
-import prawcore.exceptions
+import budget
+import clock
+import helpers
+import logs
+import metrics
+import notify
+import records
+import store
 
-from discord_webhook import DiscordWebhook, DiscordEmbed
+# praw, prawcore, dateparser and discord_webhook are imported where they are needed, they dominate startup time
+if typing.TYPE_CHECKING:
+    import praw
 
-import helpers
+HEAVY_MODULES = ("praw", "prawcore", "dateparser", "discord_webhook")
+
+# The workers share praw's session, whose rate limiter and token refresh aren't thread safe.
+# Its pacing only sees one request at a time, so the burst of parallel fetches is kept small
+MAX_FETCH_WORKERS = 8
+
+# Defaults for settings that older config.py files don't define yet
+SCHEDULE_DAYS = 30
+STORE_BACKEND = "sqlite"
+STORE_FILE = "db.sqlite3"
+BLOB_DIR = "blobs"
+SCAN_INTERVAL = 5 * 60
+SCHEDULE_INTERVAL = 15 * 60
+POST_CHECK_INTERVAL = 60
+CHECKPOINT_INTERVAL = 5 * 60
+STREAM_INTERVAL = 30
+FETCH_WORKERS = 8
+METRICS_JSON = "metrics.json"
+METRICS_PROM = None
+BUDGET_RESERVES = {"publish": 10, "ingest": 60, "backfill": 150}
+TENANTS = None
+FINGERPRINT_HOURS = 6
+LOG_FILE = "debug.log"
+LOG_MAX_BYTES = 20 * 1024 * 1024
+LOG_ROTATE_WHEN = "midnight"
+LOG_BACKUPS = 14
+LOG_MESSAGE_LIMIT = 1000
+STATUS_PORT = None
 
 from config import *
 
-db = {}
+SELFTEXT_LIMIT = 40000
+COMMENT_LIMIT = 10000
+POST_FLAIRS = ("WORK IN PROGRESS", "BOT READY", "EMERGENCY READY")
 
-def load_json(filename: str):
-    try:
-        with open(filename, "r") as file:
-            if file.readable(): # Check for corruption
-                try:
-                    return json.load(file)
-                except:
-                    raise FileNotFoundError
-            else:
-                logging.warning("Broken file detected!")
-                return {}
-    except FileNotFoundError as e:
-        logging.warning(f"Error opening db: {e} - Returning no DB")
-        return {}
+# State of the tenant that is currently worked on, see Tenant.activate
+db = {} # Post id -> records.Post
+control = records.Control()
 
-def save_json(db: dict, filename: str):
-    with open(filename, "w") as file:
-        json.dump(db, file)
+def tenant_specs():
+    """Returns the configured communities
 
-class Reddit_Handler:
-    def __init__(self):
-        global db
+    A config without TENANTS describes a single one with the old settings.
 
-        db = load_json("db.json")
-        self.reddit = None
+    Returns:
+        list: Dicts with name, drafts, target, schedule_post, webhook and db
+    """
+    if TENANTS != None:
+        return TENANTS
+    
+    return [{
+        "name": "srotd",
+        "drafts": "srotd_dev",
+        "target": "subredditoftheday",
+        "schedule_post": update_post_id,
+        "webhook": discord_webhook,
+        "db": STORE_FILE,
+        "legacy_json": "db.json",
+        "queue": "discord_queue.json"
+    }]
 
-        self.login()
+class Tenant:
+    """
+    One community: its drafts subreddit, target subreddit, schedule post, webhook and db
+    """
+    def __init__(self, spec: dict, reddit: "praw.Reddit", budget: "budget.Budgeter"):
+        self.name = spec["name"]
+        self.drafts = spec["drafts"]
+        self.target = spec["target"]
+        self.schedule_post = spec["schedule_post"]
+        self.webhook = spec["webhook"]
+        
+        self.store = store.open_store(STORE_BACKEND, spec["db"], spec.get("legacy_json"), blob_dir = BLOB_DIR)
+        self.db, self.control = self.store.load()
+        
+        self.activate()
+        self.tsrotd = TSROTD(reddit, self.store, budget, self, DiscordHelper(self.webhook, spec.get("queue", f"discord_queue_{self.name}.json")))
+    
+    def activate(self):
+        """
+        Points the module level db and control at this tenant, everything works on those
+        """
+        global db, control
+        
+        db, control = self.db, self.control
+    
+    def run(self, duty: str, *args):
+        """
+        Runs a TSROTD method on this tenant, skipped if another process is already doing the same duty.
+        
+        What other processes saved is taken over first and the results are saved before the lock
+        is released, so separate ingest, schedule and posting jobs never undo each other's work.
+        """
+        with self.store.lock(duty) as acquired:
+            if not acquired:
+                logging.info(f"Another process is running {duty} for {self.name}, skipping it")
+                metrics.count("duties_skipped")
+                return
+            
+            self.store.refresh(self.db, self.control)
+            self.activate()
+            logging.debug(f"Working on {self.name}")
+            
+            getattr(self.tsrotd, duty)(*args)
+            
+            self.checkpoint()
+    
+    def checkpoint(self):
+        self.store.save(self.db, self.control)
+    
+    def status(self):
+        """
+        Snapshot of the schedule and queue for the status API
+        """
+        return {
+            "name": self.name,
+            "drafts": self.drafts,
+            "target": self.target,
+            "next_post": self.control.next_post,
+            "last_post_utc": self.control.last_post_utc,
+            "schedule": self.tsrotd.plan,
+            "posts": {post_id: {
+                "sub": post.sub,
+                "title": post.title,
+                "author": post.author,
+                "date": post.date.isoformat() if post.date != None else None,
+                "state": post.state.value,
+                "ready": post.ready,
+                "preview": post.preview
+            } for post_id, post in self.db.items()}
+        }
+
+class Reddit_Handler:
+    def __init__(self, reddit: "praw.Reddit" = None):
+        helpers.load_date_cache("date_cache.json")
+        self.reddit = reddit
+
+        if self.reddit == None:
+            self.login()
 
         self.reddit.validate_on_submit = True
 
-        self.tsrotd = TSROTD(self.reddit)
+        # Set once the daemon is asked to stop, cuts waits for the rate limit window short
+        self.stopping = threading.Event()
+        
+        # One session, connection pool and rate limit budget for every tenant
+        self.budget = budget.Budgeter(self.reddit, BUDGET_RESERVES, self.stopping)
+        self.tenants = [Tenant(spec, self.reddit, self.budget) for spec in tenant_specs()]
+        self.turns = {} # Duty -> tenant that goes first next time, see tenants_in_turn
+        
+        # Single community setups and the offline tools work with the first tenant directly
+        self.tenants[0].activate()
+        self.tsrotd = self.tenants[0].tsrotd
 
+    @metrics.timed("login")
     def login(self):
         """
         Logs into reddit, sys.exists on error.
         """
+        import praw
+        
         try:
             self.reddit = praw.Reddit(
                 client_id = id,
                 client_secret = secret,
                 user_agent = "linux:srotd:v0.2",
                 username = "r_tomBOT",
-                password = password)
+                password = password,
+                requestor_class = metrics.requestor_class())
         except praw.exceptions.RedditAPIException as e:
             logging.critical(f"Error in login: {e}")
             sys.exit()
 
         logging.info(f"Login as: {self.reddit.user.me()}")
 
+    def tenants_in_turn(self, duty: str):
+        """
+        Returns the tenants for a round of a duty, each round starts one tenant further.
+        
+        Whoever goes first gets the shared rate limit budget first, so no tenant keeps
+        that place. Single runs start at a random tenant, as every --job is a new process.
+        """
+        start = self.turns.setdefault(duty, random.randrange(len(self.tenants))) % len(self.tenants)
+        self.turns[duty] = start + 1
+        
+        return self.tenants[start:] + self.tenants[:start]
+    
+    def for_each_tenant(self, duty: str, *args):
+        """
+        Runs a TSROTD method for every tenant in turn, a failing tenant doesn't stop the others
+        """
+        for tenant in self.tenants_in_turn(duty):
+            try:
+                tenant.run(duty, *args)
+            except Exception:
+                logging.exception(f"{duty} failed for {tenant.name}")
+    
+    def checkpoint(self):
+        for tenant in self.tenants:
+            tenant.checkpoint()
+        helpers.save_date_cache("date_cache.json")
+        metrics.write(METRICS_JSON, METRICS_PROM)
+        
     def exit(self):
-        save_json(db, "db.json")
+        notify.close_all()
+        self.checkpoint()
+        
+        # Tenants share the blob directory, other processes may have added posts
+        for tenant in self.tenants:
+            tenant.store.refresh(tenant.db, tenant.control)
+        self.tenants[0].store.blobs.prune({post.text_hash for tenant in self.tenants for post in tenant.db.values()})
+        
+        for tenant in self.tenants:
+            tenant.store.close()
         logging.info("Saved DB")
 
 class ScheduleBuilder:
-    def __init__(self):
-        self.body = ""
-        self.beginning = "=== STARTING BOT FIELD === \n\n\n Subreddit | Date | Info | Author | Link \n ---|---|----|----|----"
+    def __init__(self, days: int = SCHEDULE_DAYS, drafts: str = "srotd_dev"):
+        self.rows = []
+        self.plan = [] # The rows as data for the status API
+        self.table_header = " \n\n\n Subreddit | Date | Info | Author | Link \n ---|---|----|----|----"
+        self.beginning = "=== STARTING BOT FIELD ===" + self.table_header
+        self.continuation = "=== CONTINUED BOT FIELD ===" + self.table_header
         self.ending = "\n\n Beep, boop, bap - Booing Conalfisher 24/7"
-        
-        self.body += self.beginning
+        self.days = days
+        self.drafts = drafts
         
     def add_field(self, key: str, value: str, details: str, author: str = None, link_id: str = None):
-        self.body += f"\n{key} | {value} | {details} | {author} | {link_id}"
+        self.rows.append(f"\n{key} | {value} | {details} | {author} | {link_id}")
         
     def finish_and_return(self):
-        self.body += self.ending
-        return self.body
+        return "".join([self.beginning, *self.rows, self.ending])
     
-    def add_NEXT_POST(self, id: str):
-        global db
+    def content_hash(self):
+        return hashlib.sha256(self.finish_and_return().encode("utf-8")).hexdigest()
+    
+    def pages(self, first_limit: int, limit: int):
+        """
+        Splits the table into pages, the first one fits into first_limit characters and
+        every continuation into limit characters. Each page repeats the table header.
+        """
+        pages = []
+        page = [self.beginning]
+        size = len(self.beginning)
+        page_limit = first_limit
         
+        for row in self.rows:
+            if size + len(row) + len(self.ending) > page_limit and len(page) > 1:
+                pages.append("".join(page))
+                page = [self.continuation]
+                size = len(self.continuation)
+                page_limit = limit
+            
+            page.append(row)
+            size += len(row)
+        
+        page.append(self.ending)
+        pages.append("".join(page))
+        
+        return pages
+    
+    def add_NEXT_POST(self, id: str):
         logging.info("Next post is: " + str(id))
         
-        db["NEXT_POST"] = str(id)
+        control.next_post = str(id)
     
     def limit_title(self, title: str):
         if len(title) > 40:
             return f"{title[:50]}[...]"
         return title
     
-    def do_the_magic(self):
+    def describe_post(self, post_id: str):
+        """
+        Returns the (limited) title and the author of a post for the schedule table
+        """
+        post = db[post_id]
+        
+        author = post.author if post.author != None else "Unknown"
+        title = post.title if post.title != None else f"{post.sub}: Unknown Title"
+        
+        return self.limit_title(title), author
+    
+    def index_posts(self):
+        """
+        Sorts the db into a calendar of (year, month, day) -> post id and a
+        list of emergency posts in a single pass.
+        
+        When several posts claim the same day the first one keeps it, the others are reported.
+        """
+        calendar = {}
         emergency_posts = []
-        ready_posts = []
         
-        for sub in db.keys():
-            if sub in ("NEXT_POST", "LAST_POST_DAY", "HAS_POSTED_ABOUT_NO_SUB"):
+        for sub, post in db.items():
+            if post.emergency:
+                emergency_posts.append(sub)
                 continue
             
-            if "EMERGENCY" in db[sub].keys():
-                emergency_posts.append(sub)
-            elif "WORK_IN_PROGRESS" in db[sub].keys():
-                ready_posts.append(sub)
-            else:
-                ready_posts.append(sub)
-        
-        for i in range(0, 30):
-            found_post = False
+            if post.date == None:
+                logging.debug(f"{sub} has no date yet")
+                continue
             
-            if i != 0:
-                date = datetime.datetime.now() + datetime.timedelta(days=i)
-            else:
-                date = datetime.datetime.now()
+            po_dt = post.date
+            day = (po_dt.year, po_dt.month, po_dt.day)
+            
+            if day in calendar:
+                logging.warning(f"{sub} claims {po_dt.day}.{po_dt.month}.{po_dt.year} which is already taken by {calendar[day]}!")
+                continue
+            
+            calendar[day] = sub
+        
+        return calendar, emergency_posts
+    
+    @metrics.timed("schedule_build")
+    def do_the_magic(self):
+        calendar, emergency_posts = self.index_posts()
+        now = clock.now()
+        
+        if control.last_post_day == None:
+            control.last_post_day = 0
+        
+        for i in range(0, self.days):
+            date = now + datetime.timedelta(days=i)
                 
             day = date.day
             month = date.month
@@ -141,71 +367,39 @@ class ScheduleBuilder:
             
             if DEV and i == 0:
                 self.add_field("IN DEV MODE", f"{day}.{month}.{year}", "TODAY", "BOT", "NONE")
+                self.plan.append({"date": date.date().isoformat(), "post": None, "state": "dev"})
                 continue # Skip the first post if in DEV mode
-            
-            if db.get("LAST_POST_DAY") == None:
-                db["LAST_POST_DAY"] = 0
                 
-            if db["LAST_POST_DAY"] == day and i == 0:
+            if control.last_post_day == day and i == 0:
                 continue
             
-            for post in ready_posts:
-                
-                po_dt = db[post]["date"]
-                
-                if "IS_READY" in db[post].keys():
-                    state = "✅ Ready"
-                else:
-                    state = "⚒️ Draft"
-                    
-                if "author" in db[post].keys():
-                    author = db[post]["author"]
-                else:
-                    author = "Unknown"
-                    
-                if "title" in db[post].keys():
-                    title = db[post]["title"]
-                else:
-                    title = f"{db[post]['sub']}: Unknown Title"
+            if (post := calendar.get((year, month, day))) != None:
+                state = "✅ Ready" if db[post].ready else "⚒️ Draft"
+                title, author = self.describe_post(post)
                 
-                title = self.limit_title(title)
-                
-                if po_dt["day"] == day \
-                and po_dt["month"] == month \
-                and po_dt["year"] == year:
-                    self.add_field(title, f"{day}.{month}.{year}", f"{state}", f"u/{author}", f"[LINK](https://www.reddit.com/r/srotd_dev/comments/{post})")
-                    logging.info(f"Found sub for {day}.{month}")
-                    found_post = True
-                    
-                    ready_posts.remove(post)
-                    
-                    if i == 0:
-                        self.add_NEXT_POST(post)
-                    
-                    break
-            
-            if not found_post:
-                if len(emergency_posts) == 0:
-                    self.add_field("No Sub Available", f"{day}.{month}.{year}", "")
-                    continue
+                self.add_field(title, f"{day}.{month}.{year}", f"{state}", f"u/{author}", f"[LINK](https://www.reddit.com/r/{self.drafts}/comments/{post})")
+                self.plan.append({"date": date.date().isoformat(), "post": post, "state": "ready" if db[post].ready else "draft"})
+                logging.info(f"Found sub for {day}.{month}")
                 
                 if i == 0:
-                    self.add_NEXT_POST(emergency_posts[0])
-                
-                if "author" in db[emergency_posts[0]].keys():
-                    author = db[emergency_posts[0]]["author"]
-                else:
-                    author = "Unknown"
-                    
-                if "title" in db[emergency_posts[0]].keys():
-                    title = db[emergency_posts[0]]["title"]
-                else:
-                    title = f"{db[emergency_posts[0]]['sub']}: Unknown Title"
+                    self.add_NEXT_POST(post)
                 
-                title = self.limit_title(title)
-                
-                self.add_field(title, f"{day}.{month}.{year}", "🚨 Emergency", f"u/{author}", f"[LINK](https://www.reddit.com/r/srotd_dev/comments/{emergency_posts[0]})")
-                emergency_posts.pop(0)
+                continue
+            
+            if len(emergency_posts) == 0:
+                self.add_field("No Sub Available", f"{day}.{month}.{year}", "")
+                self.plan.append({"date": date.date().isoformat(), "post": None, "state": "empty"})
+                continue
+            
+            post = emergency_posts.pop(0)
+            
+            if i == 0:
+                self.add_NEXT_POST(post)
+            
+            title, author = self.describe_post(post)
+            
+            self.add_field(title, f"{day}.{month}.{year}", "🚨 Emergency", f"u/{author}", f"[LINK](https://www.reddit.com/r/{self.drafts}/comments/{post})")
+            self.plan.append({"date": date.date().isoformat(), "post": post, "state": "emergency"})
                 
 class TSROTD:
     """
@@ -213,18 +407,30 @@ class TSROTD:
     
     Requires RedditHandler!
     """
-    def __init__(self, reddit: praw.Reddit):
+    def __init__(self, reddit: "praw.Reddit", store: "store.SQLiteStore", budget: "budget.Budgeter", tenant: Tenant, discord: "DiscordHelper"):
         self.reddit = reddit
-        self.sub = reddit.subreddit("srotd_dev")
-        self.discord = DiscordHelper(discord_webhook)
+        self.store = store
+        self.budget = budget
+        self.tenant = tenant
+        self.sub = reddit.subreddit(tenant.drafts)
+        self.discord = discord
+        
+        self.post = PostHelper(tenant.target, reddit, store, discord)
+        self.plan = [] # Of the last schedule that was built
+        
+    @metrics.timed("posting")
+    def post_handling(self):
+        # Most checks end here without a single request, only a due post is worth waiting for
+        if not self.post.check_time():
+            return
         
-        self.post = PostHelper("subredditoftheday", reddit)
+        # Lookup and both submits - posting may use the reserves of everything else
+        if not self.budget.allow(budget.Priority.POSTING, 3, "posting") and not self.budget.wait_for_reset("posting"):
+            return
         
-    def post_handling(self):        
-        if self.post.check_time():
-            self.post.send_post()
+        self.post.send_post()
 
-    def get_top_comments_sorted_by_time(self, submission: praw.Reddit.submission):
+    def get_top_comments_sorted_by_time(self, submission: "praw.Reddit.submission"):
         comments = submission.comments
         comments.replace_more(limit=0)
         comments = comments.list()
@@ -233,52 +439,76 @@ class TSROTD:
         
         return comments
 
-    def search_for_dates(self, submission: praw.Reddit.submission):
-        global db
+    @metrics.timed("scan_comments")
+    def scan_comments(self, submission: "praw.Reddit.submission", comments: list = None, search_dates: bool = True):
+        """
+        Collects all [date], [title] and [full] directives of a submission in a
+        single pass, the comments are fetched unless they were prefetched.
+        
+        Later comments override earlier ones, so the comments are walked
+        newest first and the walk stops once every directive was found.
+        """
+        scan = {"date": None, "title": None}
+        
+        if comments == None:
+            if submission.num_comments == 0:
+                return scan
+            
+            comments = self.get_top_comments_sorted_by_time(submission)
+        
+        for comment in reversed(comments):
+            if scan["title"] != None and (scan["date"] != None or not search_dates):
+                break
+            
+            comment_body = comment.body.replace("\\", "") # new.reddit.com issue
+            comment_lower = comment_body.lower()
+            is_full = "[full]" in comment_lower
+            
+            if search_dates and scan["date"] == None \
+            and ("[date]" in comment_lower or is_full) \
+            and (date := helpers.parse_date_from_string(comment_body)) != None \
+            and helpers.check_if_date_valid(date):
+                logging.info(f"Found date comment for {submission.id}: {comment.id}")
+                scan["date"] = date
+            
+            if scan["title"] != None:
+                continue
+            
+            if "[title]" in comment_lower:
+                scan["title"] = comment_body[7:].strip()
+            elif is_full:
+                scan["title"] = comment_body[comment_body.find("r/"):]
+            else:
+                continue
+            
+            logging.info(f"Found title comment for {submission.id}: {comment.id}")
         
+        return scan
+
+    @metrics.timed("search_for_dates")
+    def search_for_dates(self, submission: "praw.Reddit.submission", scan: dict):
         if (date := helpers.parse_date_from_string(submission.title)) != None \
         and helpers.check_if_date_valid(date):
             logging.info(f"Found valid submission date in title of: {submission.id}")
-            db[submission.id]["date"] = {}
-            db[submission.id]["date"] = helpers.parse_date(date)
+            db[submission.id].date = helpers.parse_date(date)
         
-        if submission.num_comments > 0:
-            # Search for date in comments sorted by time
-            for comment in self.get_top_comments_sorted_by_time(submission):
-                comment_body = comment.body.replace("\\", "") # new.reddit.com issue
-                
-                if ("[date]" in comment_body.lower() or "[full]" in comment_body.lower()) \
-                and (date := helpers.parse_date_from_string(comment_body)) != None \
-                and helpers.check_if_date_valid(date):
-                    logging.info(f"Found date comment for {submission.id}: {comment.id}")    
-                    
-                    db[submission.id]["date"] = {}
-                    db[submission.id]["date"] = helpers.parse_date(date)
+        # Date comments override the title
+        if scan["date"] != None:
+            db[submission.id].date = helpers.parse_date(scan["date"])
     
-    def check_for_title(self, submission: praw.Reddit.submission):
-        global db
-        
+    @metrics.timed("check_for_title")
+    def check_for_title(self, submission: "praw.Reddit.submission", scan: dict):
         # Check if the submission title contains :
         if "r/" in submission.title.lower():
-            db[submission.id]["title"] = submission.title[submission.title.find("r/"):]
-            logging.info(f"Found title in submission: {db[submission.id]['title']}")
+            db[submission.id].title = submission.title[submission.title.find("r/"):]
+            logging.info(f"Found title in submission: {db[submission.id].title}")
         
-        if submission.num_comments > 0:
-            # Search for title in comments sorted by time            
-            for comment in self.get_top_comments_sorted_by_time(submission):
-                comment_body = comment.body.replace("\\", "") # new.reddit.com issue
-                
-                if "[title]" in comment_body.lower():
-                    title = comment_body[7:].strip()
-                elif "[full]" in comment_body.lower():
-                    title = comment_body[comment_body.find("r/"):]
-                else:
-                    continue
-                
-                logging.info(f"Found title comment for {submission.id}: {comment.id}")
-                db[submission.id]["title"] = title
+        # Title comments override the title
+        if scan["title"] != None:
+            db[submission.id].title = scan["title"]
 
-    def check_for_sub(self, submission: praw.Reddit.submission):
+    @metrics.timed("check_for_sub")
+    def check_for_sub(self, submission: "praw.Reddit.submission"):
         for x in submission.title.split():          
             if (match := re.match(r"^[r]\/|^\/[r]\/", x)):
                 title = x.replace(match.group(0), "").strip()
@@ -289,121 +519,446 @@ class TSROTD:
             logging.info(f"Found subreddit name of: {submission.title}")
             return submission.title
 
-    def is_ready(self, submission: praw.Reddit.submission):        
-        if "WORK_IN_PROGRESS" in db[submission.id].keys():
+    def is_ready(self, submission: "praw.Reddit.submission"):        
+        post = db[submission.id]
+        
+        if post.state == records.PostState.WORK_IN_PROGRESS:
             logging.info("Found WORK_IN_PROGRESS")
             return False
         
-        for key in ("date", "title", "sub"):
-            logging.debug(key)
-            
-            if not key in db[submission.id].keys():
-                if key == "date" and "EMERGENCY" in db[submission.id].keys():
-                    logging.info("Found post with no date that is scheduled for emergencies!")
-                    continue
+        if post.title == None or post.sub == None:
+            return False
+        
+        if post.date == None:
+            if not post.emergency:
                 return False
+            logging.info("Found post with no date that is scheduled for emergencies!")
         return True
 
-    def check_for_new_posts(self):
-        global db
-
-        for submission in self.sub.new(limit=30):
-            announce = False
+    def fetch_workers(self, count: int):
+        """
+        Returns how many comment trees may be fetched at once, at most MAX_FETCH_WORKERS
+        """
+        return max(1, min(FETCH_WORKERS, MAX_FETCH_WORKERS, count))
+    
+    @metrics.timed("fetch_comments")
+    def fetch_comment_trees(self, submissions: list):
+        """
+        Fetches the sorted comments of several submissions concurrently.
+        
+        praw paces its requests with a rate limiter that isn't thread safe, so before
+        every fetch the remaining requests are checked again. Once they can't cover a
+        request per worker the workers take turns and praw spaces them out on its own.
+        
+        Returns a dict of submission id -> comments.
+        """
+        submissions = [submission for submission in submissions if submission.num_comments > 0]
+        
+        if len(submissions) == 0:
+            return {}
+        
+        workers = self.fetch_workers(len(submissions))
+        one_at_a_time = threading.Lock()
+        
+        def fetch(submission: "praw.Reddit.submission"):
+            remaining = self.budget.remaining()
+            
+            if remaining != None and remaining < workers * 2:
+                with one_at_a_time:
+                    return self.get_top_comments_sorted_by_time(submission)
             
+            return self.get_top_comments_sorted_by_time(submission)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as pool:
+            trees = list(pool.map(fetch, submissions))
+        
+        return {submission.id: tree for submission, tree in zip(submissions, trees)}
+
+    @metrics.timed("ingest")
+    def check_for_new_posts(self, limit: int = 30):
+        if not self.budget.allow(budget.Priority.INGEST, 1, "scan"):
+            return
+        
+        self.post.known_flairs = {}
+        
+        self.ingest_submissions(self.sub.new(limit=limit))
+        
+        # Everything queued that wasn't in the listing gets checked in bulk
+        self.validate_queue(skip = self.post.known_flairs.keys())
+    
+    def ingest_submissions(self, submissions, priority: budget.Priority = budget.Priority.INGEST):
+        """
+        Updates the db from a batch of listed submissions.
+        
+        Unflaired and unchanged submissions are skipped before anything is fetched. A scan
+        sheds the submissions whose comments the budget can't cover, they keep their old
+        fingerprint and are picked up by the next scan.
+        """
+        self.ingest_changed(self.changed_submissions(submissions), priority)
+    
+    def changed_submissions(self, submissions):
+        """
+        Returns (submission, fingerprint) for the flaired submissions that changed since the last scan
+        """
+        pending = []
+
+        for submission in submissions:
             logging.debug(f"Going through submission: {submission.title}")
             
-            if not submission.link_flair_text in ("WORK IN PROGRESS", "BOT READY", "EMERGENCY READY"):
+            if not submission.link_flair_text in POST_FLAIRS:
                 continue
             
+            self.post.known_flairs[submission.id] = submission.link_flair_text
+            
             logging.info("Found BOT READY / EMERGENCY submission!")
             
-            if not submission.id in db.keys():
-                db[submission.id] = {}
-                announce = True
+            # Skip submissions that haven't changed since the last run
+            fingerprint = helpers.submission_fingerprint(submission, FINGERPRINT_HOURS)
             
-            # Check if the post has been removed
-            if submission.removed:
-                logging.warning(f"Post {submission.id} has been removed!")
-                db.pop(submission.id)
+            if submission.id in db.keys() and db[submission.id].fingerprint == fingerprint:
+                logging.debug(f"Submission {submission.id} is unchanged, skipping")
+                metrics.count("submissions_unchanged")
                 continue
-                
-            # Add author
-            db[submission.id]["author"] = submission.author.name
             
-            if submission.link_flair_text == "EMERGENCY READY":
-                db[submission.id]["EMERGENCY"] = None
-                
-                # Remove IS_READY if it was set
-                if "IS_READY" in db[submission.id].keys():
-                    db[submission.id].pop("IS_READY")
-            elif submission.link_flair_text == "BOT READY":
-                # Remove EMERGENCY or WORK_IN_PROGRESS if it was set
-                
-                if "EMERGENCY" in db[submission.id].keys():
-                    db[submission.id].pop("EMERGENCY")
-                
-                if "WORK_IN_PROGRESS" in db[submission.id].keys():
-                    db[submission.id].pop("WORK_IN_PROGRESS")
-            elif submission.link_flair_text == "WORK IN PROGRESS":
-                db[submission.id]["WORK_IN_PROGRESS"] = None
-                
-                # Remove EMERGENCY or IS_READY if it was set
-                if "EMERGENCY" in db[submission.id].keys():
-                    db[submission.id].pop("EMERGENCY")
-                if "IS_READY" in db[submission.id].keys():
-                    db[submission.id].pop("IS_READY")
-                
-            # Get the text of the post
-            db[submission.id]["text"] = submission.selftext
+            pending.append((submission, fingerprint))
+        
+        return pending
+    
+    def ingest_changed(self, pending: list, priority: budget.Priority):
+        """
+        Fetches the comments of the changed submissions and updates the db from them
+        """
+        if priority == budget.Priority.INGEST and (affordable := self.budget.affordable(priority)) != None \
+        and len(pending) > affordable:
+            logging.warning(f"Budget covers {affordable} of {len(pending)} changed submissions, the rest waits for the next scan")
+            metrics.count("budget_shed_submissions", len(pending) - affordable)
+            pending = pending[:affordable]
+        
+        metrics.count("submissions_processed", len(pending))
+        
+        # The network waits overlap, the results are still applied in listing order
+        trees = self.fetch_comment_trees(self.fetched_submissions(pending))
+        
+        for submission, fingerprint in pending:
+            self.process_submission(submission, fingerprint, trees.get(submission.id, []))
+    
+    def fetched_submissions(self, pending: list):
+        """
+        Returns the changed submissions whose comment trees have to be fetched
+        """
+        return [submission for submission, _ in pending if not submission.removed and submission.num_comments > 0]
+    
+    @metrics.timed("backfill")
+    def backfill(self, since: datetime.datetime = None):
+        """
+        Walks the whole listing (or back to since) a page at a time through the normal ingest.
+        
+        The last finished page is kept in BACKFILL_AFTER, an interrupted backfill resumes after it.
+        """
+        params = {}
+        
+        if (after := control.backfill_after) != None:
+            logging.info(f"Resuming backfill after {after}")
+            params["after"] = after
+        
+        page = []
+        
+        for submission in self.sub.new(limit = None, params = params):
+            if since != None and submission.created_utc < since.timestamp():
+                break
             
-            logging.debug(f"The text is: {db[submission.id]['text']}")
+            page.append(submission)
             
-            if not "ANNOUNCED" in db[submission.id].keys():
-                db[submission.id]["ANNOUNCED"] = False
+            if len(page) == 100:
+                if not self.backfill_page(page):
+                    return
+                page = []
+        
+        if not self.backfill_page(page):
+            return
+        
+        control.backfill_after = None
+        self.store.save(db, control, ["BACKFILL_AFTER"])
+        logging.info("Backfill finished")
+    
+    def backfill_page(self, page: list):
+        """
+        Ingests a page of the backfill, returns False if the bot is stopping before it could
+        """
+        if len(page) == 0:
+            return True
+        
+        # Unchanged submissions cost nothing, only the comment trees still to fetch count
+        pending = self.changed_submissions(page)
+        cost = len(self.fetched_submissions(pending))
+        
+        # A backfill has nowhere to catch up later, so it waits out the window instead of shedding
+        while not self.budget.allow(budget.Priority.BACKFILL, cost, "backfill page"):
+            if not self.budget.wait_for_reset("the next backfill page"):
+                logging.info(f"Backfill stopped, it resumes after {control.backfill_after}")
+                return False
+        
+        self.ingest_changed(pending, budget.Priority.BACKFILL)
+        
+        control.backfill_after = page[-1].name
+        self.store.save(db, control, ["BACKFILL_AFTER"])
+        logging.info(f"Backfilled up to {page[-1].name}")
+        
+        return True
+    
+    @metrics.timed("stream")
+    def ingest_new_comments(self):
+        """
+        Routes the comments made since the last call to the posts they belong to.
+        
+        Only [date], [title] and [full] comments on known posts update the db. The cursor
+        (newest timestamp and the ids seen at it) is kept in COMMENT_CURSOR, so a restart
+        continues where the last run stopped.
+        
+        The feed only lists new comments. Edits to existing ones don't change the submission
+        either, they are only picked up once its fingerprint expires and the next scan reads
+        the whole comment tree again (see FINGERPRINT_HOURS).
+        """
+        if not self.budget.allow(budget.Priority.INGEST, 1, "comment stream"):
+            return
+        
+        if control.comment_cursor == None:
+            # Older comments were already seen by the full scans
+            control.comment_cursor = [clock.timestamp(), []]
+            self.store.save(db, control, ["COMMENT_CURSOR"])
+        
+        cursor_time, cursor_ids = control.comment_cursor
+        new_comments = []
+        
+        for comment in self.sub.comments(limit = 100):
+            if comment.created_utc < cursor_time:
+                break
+            if comment.created_utc == cursor_time and comment.id in cursor_ids:
+                continue
+            new_comments.append(comment)
+        else:
+            if len(new_comments) == 100:
+                logging.warning("More than 100 new comments, the next full scan has to catch up")
+        
+        if len(new_comments) == 0:
+            return
+        
+        newest = max(comment.created_utc for comment in new_comments)
+        seen = [comment.id for comment in new_comments if comment.created_utc == newest]
+        control.comment_cursor = [newest, seen + cursor_ids if newest == cursor_time else seen]
+        
+        # Oldest first, later directives override earlier ones
+        for comment in sorted(new_comments, key = lambda x: x.created_utc):
+            post_id = comment.link_id[3:]
             
-            logging.info(submission.link_flair_text)
+            if not post_id in db.keys():
+                continue
             
-            # If the post is not an emergency post, search for dates
-            if submission.link_flair_text != "EMERGENCY READY":
-                self.search_for_dates(submission)
-                
-            # Search for title
-            self.check_for_title(submission)
+            submission = comment.submission
+            scan = self.scan_comments(submission, [comment], search_dates = not db[post_id].emergency)
             
-            # Search for subreddit
-            if (sub := self.check_for_sub(submission)) != "":
-                if sub.endswith(":"):
-                    sub = sub[:-1]
-                db[submission.id]["sub"] = sub
+            if scan["date"] != None:
+                db[post_id].date = helpers.parse_date(scan["date"])
+            if scan["title"] != None:
+                db[post_id].title = scan["title"]
             
             if self.is_ready(submission):
-                logging.info(f"Announcing {submission.id}")
-                db[submission.id]["IS_READY"] = None
-                announce = True
+                db[post_id].ready = True
+            
+            self.store.save(db, control, [post_id])
+        
+        self.store.save(db, control, ["COMMENT_CURSOR"])
+        metrics.count("streamed_comments", len(new_comments))
+    
+    def apply_flair(self, post_id: str, flair: str):
+        """
+        Sets the state of a post according to its flair, emergency and work in progress posts lose IS_READY
+        """
+        post = db[post_id]
+        
+        if flair == "EMERGENCY READY":
+            post.state = records.PostState.EMERGENCY
+            post.ready = False
+        elif flair == "BOT READY":
+            post.state = records.PostState.BOT_READY
+        elif flair == "WORK IN PROGRESS":
+            post.state = records.PostState.WORK_IN_PROGRESS
+            post.ready = False
+    
+    @metrics.timed("validate")
+    def validate_queue(self, skip = ()):
+        """
+        Looks up every queued post with bulk reddit.info calls of 100 posts each.
+        
+        Posts that were deleted, removed or lost their flair are dropped as ghosts,
+        flair changes are applied to the rest.
+        """
+        post_ids = [key for key in db.keys() if key not in skip]
+        
+        for i in range(0, len(post_ids), 100):
+            if not self.budget.allow(budget.Priority.INGEST, 1, "queue validation"):
+                return
+            
+            batch = post_ids[i:i + 100]
+            found = {submission.id: submission for submission in self.reddit.info(fullnames = [f"t3_{post_id}" for post_id in batch])}
+            
+            for post_id in batch:
+                submission = found.get(post_id)
+                
+                if submission == None or submission.removed or submission.author == None \
+                or not submission.link_flair_text in POST_FLAIRS:
+                    logging.warning(f"Ghost in DB: {post_id}")
+                    db.pop(post_id)
+                    continue
                 
-            if announce and not db[submission.id]["ANNOUNCED"] and not "DEFINITELY_ANNOUNCED" in db[submission.id].keys():  
-                db[submission.id]["ANNOUNCED"] = True              
-                self.discord.new_post(db[submission.id], f"https://reddit.com{submission.permalink}")
-                db[submission.id]["DEFINITELY_ANNOUNCED"] = True
+                self.post.known_flairs[post_id] = submission.link_flair_text
+                self.apply_flair(post_id, submission.link_flair_text)
+                
+                if self.is_ready(submission):
+                    db[post_id].ready = True
             
+            self.store.save(db, control, batch)
+            logging.info(f"Validated {len(batch)} queued posts")
+    
+    def process_submission(self, submission: "praw.Reddit.submission", fingerprint: str, comments: list):
+        """
+        Updates the db entry of a flaired submission, comments are its sorted comment tree
+        """
+        announce = False
+        
+        if not submission.id in db.keys():
+            db[submission.id] = records.Post()
+            announce = True
+        
+        # Check if the post has been removed
+        if submission.removed:
+            logging.warning(f"Post {submission.id} has been removed!")
+            db.pop(submission.id)
+            self.store.save(db, control, [submission.id])
+            return
+        
+        post = db[submission.id]
+        
+        # Add author
+        post.author = submission.author.name
+        
+        self.apply_flair(submission.id, submission.link_flair_text)
+            
+        # The text goes into the blob store, it's only read again when posting
+        self.store.blobs.attach(post, submission.selftext)
+        
+        logging.debug(f"The text has {len(submission.selftext)} characters, hash {post.text_hash}")
+        
+        logging.info(submission.link_flair_text)
+        
+        # Scan the comments once, dates are irrelevant for emergency posts
+        is_emergency = submission.link_flair_text == "EMERGENCY READY"
+        scan = self.scan_comments(submission, comments, search_dates = not is_emergency)
+        
+        # If the post is not an emergency post, search for dates
+        if not is_emergency:
+            self.search_for_dates(submission, scan)
+            
+        # Search for title
+        self.check_for_title(submission, scan)
+        
+        # Search for subreddit
+        if (sub := self.check_for_sub(submission)) != "":
+            if sub.endswith(":"):
+                sub = sub[:-1]
+            post.sub = sub
+        
+        if self.is_ready(submission):
+            logging.info(f"Announcing {submission.id}")
+            post.ready = True
+            announce = True
+            
+        if announce and not post.announced and not post.definitely_announced:
+            post.announced = True
+            self.discord.new_post(post, f"https://reddit.com{submission.permalink}")
+            post.definitely_announced = True
+        
+        post.fingerprint = fingerprint
+        
+        # Commit every submission on its own, a crash only loses the current one
+        self.store.save(db, control, [submission.id])
+        
+    @metrics.timed("publish")
     def create_schedule(self):        
-        schedule = ScheduleBuilder()
+        schedule = ScheduleBuilder(drafts = self.tenant.drafts)
         schedule.do_the_magic()
-        text = schedule.finish_and_return()
+        self.plan = schedule.plan
+        
+        # Editing an identical schedule only costs API calls and clutters the post history
+        content_hash = schedule.content_hash()
+        
+        if control.schedule_hash == content_hash:
+            logging.info("Schedule is unchanged, not editing")
+            return
+        
+        # The hash stays the old one, so a deferred schedule is published by the next run
+        if not self.budget.allow(budget.Priority.PUBLISH, 2 + len(control.schedule_comments or []), "schedule publishing"):
+            return
         
-        submission = self.reddit.submission(update_post_id)
+        submission = self.reddit.submission(self.tenant.schedule_post)
         
         body = submission.selftext.split("=== STARTING BOT FIELD ===", 1)[0]
-        submission.edit(body + text)
+        pages = schedule.pages(SELFTEXT_LIMIT - len(body), COMMENT_LIMIT)
+        
+        submission.edit(body + pages[0])
+        self.publish_continuations(submission, pages[1:])
+        
+        control.schedule_hash = content_hash
+    
+    def publish_continuations(self, submission: "praw.Reddit.submission", pages: list):
+        """
+        Keeps one reply to the schedule post per page that didn't fit into the post itself
+        """
+        comment_ids = list(control.schedule_comments or [])
+        
+        for i, page in enumerate(pages):
+            if i < len(comment_ids):
+                self.reddit.comment(comment_ids[i]).edit(page)
+            else:
+                comment_ids.append(submission.reply(page).id)
+                logging.info(f"Schedule continued in comment {comment_ids[-1]}")
+        
+        for comment_id in comment_ids[len(pages):]:
+            self.reddit.comment(comment_id).delete()
+        
+        control.schedule_comments = comment_ids[:len(pages)]
 
 class PostHelper:
-    def __init__(self, subreddit: str, reddit: praw.Reddit):
+    def __init__(self, subreddit: str, reddit: "praw.Reddit", store: "store.SQLiteStore", discord: "DiscordHelper"):
         self.reddit = reddit
+        self.store = store
+        self.discord = discord
         self.sub = reddit.subreddit(subreddit)
+        self.known_flairs = {} # Flairs seen by the last scan, spares a lookup in send_post
+    
+    def next_post_time(self):
+        """Earliest time the next post may go out: 22 hours after the last known post, but not before noon"""
+        if (last_post := control.last_post_utc) == None:
+            return None
+        
+        next_time = datetime.datetime.utcfromtimestamp(last_post) + datetime.timedelta(hours=22)
+        
+        if next_time.hour < 12:
+            next_time = next_time.replace(hour=12, minute=0, second=0, microsecond=0)
+        
+        return next_time
     
     def check_time(self):
         """Checks if the time is right to post the post. Also checks whether anything has been posted so far today"""
-        now = datetime.datetime.now()
+        now = clock.now()
+        
+        if now.hour < 12:
+            return False
+        
+        # The listing is only needed once our own last post is old enough
+        if (next_time := self.next_post_time()) != None and now < next_time:
+            logging.debug(f"Next post isn't due before {next_time}")
+            return False
         
         for submission in self.sub.new(limit=3):
             if submission.removed:
@@ -413,41 +968,59 @@ class PostHelper:
             difference = now - time_post
             if (difference.total_seconds() / 3600) < 22:
                 logging.info("Last post was less than 22 hours ago")
+                
+                # Someone else posted, no need to look again before 22 hours after their post
+                control.last_post_utc = max(control.last_post_utc or 0, submission.created_utc)
                 return False
         
-        if now.hour >= 12:
-            return True
+        return True
         
+    def load_text(self, post_id: str):
+        """Returns the body of a post, refetched from reddit if the blob went missing"""
+        post = db[post_id]
+        
+        if post.text_hash != None and (text := self.store.blobs.get(post.text_hash)) != None:
+            return text
+        
+        logging.warning(f"Body of {post_id} isn't stored, fetching it again")
+        text = self.reddit.submission(post_id).selftext
+        self.store.blobs.attach(post, text)
+        
+        return text
+    
     def send_post(self):
+        import prawcore
+        
         try:
-            post_id = db["NEXT_POST"]
+            if (post_id := control.next_post) == None:
+                raise KeyError("NEXT_POST")
             
             if post_id not in db.keys():
-                db.pop("NEXT_POST")
+                control.next_post = None
                 logging.warning("Post wasn't in DB!")
                 return
             
             post = db[post_id]
 
-            try:
-                devsub_post = self.reddit.submission(post_id)
-                flair = devsub_post.link_flair_text 
-            except prawcore.NotFound:
-                flair = "404"
-                logging.warning("Reddit returned 404 on request!")
+            if (flair := self.known_flairs.get(post_id)) == None:
+                try:
+                    devsub_post = self.reddit.submission(post_id)
+                    flair = devsub_post.link_flair_text 
+                except prawcore.NotFound:
+                    flair = "404"
+                    logging.warning("Reddit returned 404 on request!")
                 
             logging.debug(f"Flair is: {flair}")
 
-            if not flair in ("BOT READY", "EMERGENCY"):
+            if not flair in ("BOT READY", "EMERGENCY", "EMERGENCY READY"):
                 logging.warning("Ghost in DB!")
-                db.pop(db["NEXT_POST"])
-                db.pop("NEXT_POST")
+                db.pop(post_id)
+                control.next_post = None
             
                 return
         except (TypeError, KeyError):
             try:
-                if "HAS_POSTED_ABOUT_NO_SUB" in db.keys() \
-                and db["HAS_POSTED_ABOUT_NO_SUB"] == datetime.datetime.now().day:
+                if control.has_posted_about_no_sub == clock.now().day:
                     logging.debug("Couldn't find next sub but already warned about it!")
                 else:
                     raise KeyError
@@ -457,45 +1030,50 @@ class PostHelper:
                 # discord.basic_message("Error Posting Post",
                 #                     "Couldn't find NEXT_POST in DB",
                 #                     Color.red)
-                db["HAS_POSTED_ABOUT_NO_SUB"] = datetime.datetime.now().day
+                control.has_posted_about_no_sub = clock.now().day
             finally:
                 return
         
-        title = "{} - /r/{}: {}".format(helpers.output_good_post_date_str(), post["sub"], post["title"]) # formatted strings fail on dict extractions
+        title = f"{helpers.output_good_post_date_str()} - /r/{post.sub}: {post.title}"
         
         if not DEV:
             submission = self.sub.submit(
                 title = title,
-                selftext = post["text"]
+                selftext = self.load_text(post_id)
             )
+            control.last_post_utc = clock.timestamp()
         
-            discord = DiscordHelper(discord_webhook)
-            discord.basic_message("Posted To Subreddit!", f"https://reddit.com{submission.permalink}", Color.green)
+            self.discord.basic_message("Posted To Subreddit!", f"https://reddit.com{submission.permalink}", Color.green)
 
             #devsub_post.flair.select("05cf3a30-3dc5-11e4-9983-12313b0ab8de")
     
-            hostsub = self.reddit.subreddit(post["sub"])
+            hostsub = self.reddit.subreddit(post.sub)
             hostsub.submit(
-                title = "Congratulations, /r/{}! You are Subreddit of the Day!".format(post["sub"]),
+                title = f"Congratulations, /r/{post.sub}! You are Subreddit of the Day!",
                 url = f"https://reddit.com{submission.permalink}"
             )
         else:
-            logging.debug("Script would have posted about: {}".format(post["sub"]))
-            discord = DiscordHelper(discord_webhook)
-            discord.basic_message("Debug Info", "Script would have posted about {} but posting is currently disabled".format(post["sub"]), Color.red)
+            logging.debug(f"Script would have posted about: {post.sub}")
+            self.discord.basic_message("Debug Info", f"Script would have posted about {post.sub} but posting is currently disabled", Color.red)
     
-        db["LAST_POST_DAY"] = datetime.datetime.now().day
+        control.last_post_day = clock.now().day
     
-        db.pop(db["NEXT_POST"])
-        db.pop("NEXT_POST")
+        db.pop(post_id)
+        control.next_post = None
 
 class DiscordHelper:
-    def __init__(self, webhook_url: str):
+    def __init__(self, webhook_url: str, queue_file: str = "discord_queue.json"):
         # Extract from config.py
-        self.webhook = DiscordWebhook(webhook_url)
-        self.embed = DiscordEmbed()
+        self.webhook_url = webhook_url
+        self.queue_file = queue_file
+        self.embed = None
+        
+        # Created right away, so what a crashed run left undelivered goes out on startup
+        self.queue = notify.get_queue(self.webhook_url, self.queue_file)
             
     def basic_message(self, title: str, message: str, color):
+        from discord_webhook import DiscordEmbed
+        
         if isinstance(color, Color):
             color = color.value
         
@@ -508,17 +1086,19 @@ class DiscordHelper:
         
         self.send_message()
         
-    def new_post(self, data: dict, post_url: str):
-        if "IS_READY" in data.keys():
+    def new_post(self, post: records.Post, post_url: str):
+        from discord_webhook import DiscordEmbed
+        
+        if post.ready:
             title = "New Post Ready"
             color = Color.green
         else:
             title = "New Draft Post"
             color = Color.gray
         
-        sub = data["sub"] if "sub" in data.keys() else "UNKNOWN SUBREDDIT"
-        post_title = data["title"] if "title" in data.keys() else "UNKNOWN TITLE"
-        text = data["text"] if "text" in data.keys() else "UNKNOWN TEXT"
+        sub = post.sub if post.sub != None else "UNKNOWN SUBREDDIT"
+        post_title = post.title if post.title != None else "UNKNOWN TITLE"
+        text = post.preview if post.preview != None else "UNKNOWN TEXT"
         
         self.embed = DiscordEmbed(
             title = f"/r/{sub}: {post_title}",
@@ -530,49 +1110,154 @@ class DiscordHelper:
         
         self.embed.set_author(name = "AnnsAnn Bot", url = "https://github.com/tumGER/SubredditOfTheDay-Schedule-Bot", icon_url = "https://avatars.githubusercontent.com/u/25822956?v=4")
         
-        if "date" in data.keys():
-            dt = data["date"]
-            date = "{}.{}.{}".format(dt["day"], dt["month"], dt["year"])
-            
-            self.embed.add_embed_field(name = "Date", value = date)
+        if (dt := post.date) != None:
+            self.embed.add_embed_field(name = "Date", value = f"{dt.day}.{dt.month}.{dt.year}")
             
-        self.embed.add_embed_field(name = "Status", value = "Emergency Post" if "EMERGENCY" in data.keys() else "Normal Post")
+        self.embed.add_embed_field(name = "Status", value = "Emergency Post" if post.emergency else "Normal Post")
         
-        self.webhook.add_embed(self.embed)
-        logging.debug(self.webhook.execute(True))
+        self.send_message()
         
     def send_message(self):
-        self.webhook.add_embed(self.embed)
-        logging.debug(self.webhook.execute(True))
+        # Delivered in the background, see notify.NotificationQueue
+        self.queue.put(dict(self.embed.__dict__))
 
 class Color(enum.Enum):
     red = "ff0000"
     green = "00dd1f"
     gray = "a0a0a0"   
 
-def main():      
-    logging.root.handlers = []
-    logging.basicConfig(
-        level=logging.DEBUG if DEV else logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(message)s",
-        handlers=[
-            logging.FileHandler("debug.log"),
-            logging.StreamHandler()
-        ]
-    )
+# --job name -> TSROTD duty
+JOBS = {
+    "ingest": "check_for_new_posts",
+    "schedule": "create_schedule",
+    "post": "post_handling"
+}
+
+def run_daemon(reddit: Reddit_Handler):
+    """
+    Keeps the login and the db in memory and runs every duty at its own interval until SIGTERM
+    """
+    import daemon
+    
+    # One task per duty goes through the tenants in turn, see Reddit_Handler.tenants_in_turn.
+    # Tenant.run saves after every duty, a crash after posting never posts twice
+    server = None
+    
+    def publish():
+        server.publish({tenant.name: tenant.status() for tenant in reddit.tenants}, metrics.metrics.summary())
+    
+    def run_duty(duty: str):
+        for tenant in reddit.tenants_in_turn(duty):
+            try:
+                tenant.run(duty)
+            except Exception:
+                logging.exception(f"{duty} failed for {tenant.name}")
+            
+            if server != None:
+                publish()
+    
+    def shutdown():
+        if server != None:
+            server.close()
+        reddit.exit()
+    
+    tasks = []
+    for name, interval, duty in [("scan", SCAN_INTERVAL, "check_for_new_posts"),
+                                 ("stream", STREAM_INTERVAL, "ingest_new_comments"),
+                                 ("schedule", SCHEDULE_INTERVAL, "create_schedule"),
+                                 ("posting", POST_CHECK_INTERVAL, "post_handling")]:
+        tasks.append(daemon.Task(name, interval, functools.partial(run_duty, duty)))
+    tasks.append(daemon.Task("checkpoint", CHECKPOINT_INTERVAL, reddit.checkpoint))
+    
+    if STATUS_PORT != None:
+        import status
+        
+        server = status.StatusServer(STATUS_PORT)
+        publish()
+    
+    daemon.Daemon(tasks, shutdown, reddit.stopping).run()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = "SROTD Schedule Bot")
+    parser.add_argument("--import-times", action = "store_true",
+                        help = "report how long importing each heavy dependency takes and exit")
+    parser.add_argument("--daemon", action = "store_true",
+                        help = "keep running and do every duty at its own interval instead of a single pass")
+    parser.add_argument("--backfill", action = "store_true",
+                        help = "go through every post of the drafts subreddit instead of the newest 30, resumes an interrupted backfill")
+    parser.add_argument("--since", type = datetime.datetime.fromisoformat, metavar = "YYYY-MM-DD",
+                        help = "with --backfill, stop at posts older than this date")
+    parser.add_argument("--job", choices = JOBS.keys(),
+                        help = "only do one duty, so ingest, schedule publishing and posting can run as separate jobs")
+    parser.add_argument("--profile", metavar = "DIR",
+                        help = "write a cProfile capture, collapsed stacks and a hotspot report per phase to DIR")
+    
+    return parser.parse_args()
+
+def main(args: argparse.Namespace):      
+    # Writing happens on the listener's thread, see logs.py
+    listener = logs.setup(logging.DEBUG if DEV else logging.INFO, LOG_FILE, LOG_MAX_BYTES,
+                          LOG_ROTATE_WHEN, LOG_BACKUPS, LOG_MESSAGE_LIMIT)
     
+    try:
+        if args.import_times:
+            for module, seconds in helpers.measure_imports(HEAVY_MODULES):
+                logging.info(f"Importing {module} took {seconds * 1000:.1f}ms")
+            return
+        
+        if args.profile:
+            import profiling
+            
+            metrics.metrics.profiler = profiling.Profiler(args.profile)
+            try:
+                run(args)
+            finally:
+                metrics.metrics.profiler.write()
+            return
+        
+        run(args)
+    finally:
+        listener.stop()
+
+def run(args: argparse.Namespace):
+    """
+    One pass over every duty, a single job, the daemon or a backfill
+    """
     reddit = Reddit_Handler()
-    reddit.tsrotd.check_for_new_posts()
-    reddit.tsrotd.create_schedule()
-    reddit.tsrotd.post_handling()
+    
+    if args.daemon:
+        run_daemon(reddit)
+        return
+    
+    if args.backfill:
+        metrics.metrics.job = "backfill"
+        reddit.for_each_tenant("backfill", args.since)
+        reddit.exit()
+        return
+    
+    if args.job != None:
+        metrics.metrics.job = args.job
+        reddit.for_each_tenant(JOBS[args.job])
+        reddit.exit()
+        return
+    
+    reddit.for_each_tenant("check_for_new_posts")
+    reddit.for_each_tenant("create_schedule")
+    reddit.checkpoint()
+    reddit.for_each_tenant("post_handling")
+    reddit.checkpoint()
     
     if DEV:
         logging.debug("Sending DEV test post!")
-        reddit.tsrotd.post.send_post()
+        for tenant in reddit.tenants:
+            tenant.activate()
+            tenant.tsrotd.post.send_post()
     
     reddit.exit()
 
 if __name__ == "__main__":
+    args = parse_args()
+    
     print("Starting ...")
     print("Running in DEV mode" if DEV else "Running in PROD mode")
-    main()
\ No newline at end of file
+    main(args)
\ No newline at end of file
@@ -0,0 +1,213 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+import store
+
+class Metrics:
+    """
+    Durations, counters and HTTP statistics since the process started
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.phases = {}
+        self.counters = {}
+        self.gauges = {}
+        self.http = {}
+        self.profiler = None # profiling.Profiler of a --profile run
+        self.job = None # Jobs running side by side write their own files, see write
+
+    @contextlib.contextmanager
+    def timed(self, phase: str):
+        """
+        Measures a block, also usable as a decorator
+        """
+        capture = self.profiler.capture(phase) if self.profiler != None else contextlib.nullcontext()
+
+        start = time.perf_counter()
+        try:
+            with capture:
+                yield
+        finally:
+            seconds = time.perf_counter() - start
+
+            with self.lock:
+                stats = self.phases.setdefault(phase, {"runs": 0, "seconds": 0.0, "max_seconds": 0.0})
+                stats["runs"] += 1
+                stats["seconds"] += seconds
+                stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe_http(self, service: str, seconds: float, status: int, size: int, headers: dict = None):
+        """
+        Records one outbound HTTP request, reddit's rate limit headers become gauges
+        """
+        with self.lock:
+            stats = self.http.setdefault(service, {"requests": 0, "seconds": 0.0, "bytes": 0, "status": {}})
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            stats["bytes"] += size
+            stats["status"][str(status)] = stats["status"].get(str(status), 0) + 1
+
+        for header in ("remaining", "used", "reset"):
+            if headers != None and (value := headers.get(f"x-ratelimit-{header}")) != None:
+                self.gauge(f"{service}_ratelimit_{header}", float(value))
+
+                # The header counts seconds from now, the timestamp stays valid after the request
+                if header == "reset":
+                    self.gauge(f"{service}_ratelimit_reset_timestamp", time.time() + float(value))
+
+    def summary(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "updated": time.time(),
+                "phases": json.loads(json.dumps(self.phases)),
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "http": json.loads(json.dumps(self.http))
+            }
+
+    def prometheus(self):
+        """
+        Renders the summary in the Prometheus text format, every value is a gauge since process start
+        """
+        summary = self.summary()
+        lines = []
+
+        def metric(name: str, help: str, samples: list):
+            lines.append(f"# HELP srotd_{name} {help}")
+            lines.append(f"# TYPE srotd_{name} gauge")
+            for labels, value in samples:
+                if self.job != None:
+                    labels = {**labels, "run": self.job}
+                label = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"srotd_{name}{{{label}}} {value}" if label else f"srotd_{name} {value}")
+
+        phases = summary["phases"]
+        metric("phase_runs", "Runs of a phase", [({"phase": phase}, stats["runs"]) for phase, stats in phases.items()])
+        metric("phase_seconds", "Seconds spent in a phase", [({"phase": phase}, stats["seconds"]) for phase, stats in phases.items()])
+        metric("phase_max_seconds", "Longest single run of a phase", [({"phase": phase}, stats["max_seconds"]) for phase, stats in phases.items()])
+
+        http = summary["http"]
+        metric("http_requests", "Outbound HTTP requests", [({"service": service, "status": status}, count)
+                                                            for service, stats in http.items() for status, count in stats["status"].items()])
+        metric("http_seconds", "Seconds spent waiting on HTTP requests", [({"service": service}, stats["seconds"]) for service, stats in http.items()])
+        metric("http_bytes", "Bytes received from HTTP requests", [({"service": service}, stats["bytes"]) for service, stats in http.items()])
+
+        for name, value in summary["counters"].items():
+            metric(name, f"Counter {name}", [({}, value)])
+        for name, value in summary["gauges"].items():
+            metric(name, f"Gauge {name}", [({}, value)])
+
+        metric("last_update_timestamp_seconds", "When these metrics were written", [({}, summary["updated"])])
+
+        return "\n".join(lines) + "\n"
+
+    def path(self, filename: str):
+        """
+        Returns where the metrics of this process go, metrics.json becomes metrics.<job>.json for a job
+        """
+        if self.job == None:
+            return filename
+
+        root, extension = os.path.splitext(filename)
+        return f"{root}.{self.job}{extension}"
+
+    def write(self, json_file: str = None, prometheus_file: str = None):
+        """
+        Writes the JSON summary and / or the Prometheus textfile, both atomically
+        """
+        if json_file:
+            with store.replacing(self.path(json_file), sync = False) as file:
+                json.dump(self.summary(), file, indent = 2)
+
+        if prometheus_file:
+            with store.replacing(self.path(prometheus_file), sync = False) as file:
+                file.write(self.prometheus())
+
+metrics = Metrics()
+
+def timed(phase: str):
+    """Measures a function or block into the shared metrics
+
+    Args:
+        phase (str): Name of the phase
+    """
+    return metrics.timed(phase)
+
+def count(name: str, value: int = 1):
+    """Adds to a counter of the shared metrics
+
+    Args:
+        name (str): Name of the counter
+        value (int): Amount to add
+    """
+    metrics.count(name, value)
+
+def gauge_value(name: str):
+    """Reads a gauge of the shared metrics
+
+    Args:
+        name (str): Name of the gauge
+
+    Returns:
+        None or float: None if it was never set
+    """
+    with metrics.lock:
+        return metrics.gauges.get(name)
+
+def observe_http(service: str, seconds: float, status: int, size: int, headers: dict = None):
+    """Records an outbound HTTP request into the shared metrics, see Metrics.observe_http"""
+    metrics.observe_http(service, seconds, status, size, headers)
+
+def write(json_file: str = None, prometheus_file: str = None):
+    """Writes the shared metrics, see Metrics.write
+
+    Args:
+        json_file (str): Path of the JSON summary
+        prometheus_file (str): Path of the Prometheus textfile
+    """
+    metrics.write(json_file, prometheus_file)
+
+def requestor_class():
+    """Returns a prawcore Requestor that records every request to reddit
+
+    Returns:
+        type: Subclass of prawcore.Requestor, pass it to praw.Reddit as requestor_class
+    """
+    import prawcore
+
+    class InstrumentedRequestor(prawcore.Requestor):
+        def request(self, *args, **kwargs):
+            start = time.perf_counter()
+            response = super().request(*args, **kwargs)
+
+            metrics.observe_http("reddit", time.perf_counter() - start, response.status_code,
+                                 len(response.content), response.headers)
+            return response
+
+    return InstrumentedRequestor
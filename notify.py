@@ -0,0 +1,438 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+import metrics
+import store
+
+MAX_EMBEDS = 10 # Discord accepts up to 10 embeds per webhook message
+MAX_BACKOFF = 60
+LINGER = 0.5 # Seconds to wait for more embeds of a burst before sending
+COMPACT_SLACK = 100 # Journal lines beyond twice the pending embeds before it is rewritten
+
+_queues = {}
+
+def send_webhook(webhook_url: str, embeds: list):
+    """Sends embeds as a single webhook message
+
+    Args:
+        webhook_url (str): The webhook
+        embeds (list): Up to MAX_EMBEDS embed dicts
+
+    Returns:
+        tuple: (delivered, retry_after) - retry_after is None unless the message should be retried
+    """
+    from discord_webhook import DiscordWebhook
+
+    webhook = DiscordWebhook(webhook_url)
+    for embed in embeds:
+        webhook.add_embed(embed)
+
+    start = time.perf_counter()
+
+    try:
+        response = webhook.execute()
+    except Exception as e:
+        logging.warning(f"Error sending to Discord: {e}")
+        metrics.count("discord_errors")
+        return False, 0
+
+    metrics.observe_http("discord", time.perf_counter() - start, response.status_code, len(response.content), response.headers)
+    logging.debug(response)
+
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.json()["retry_after"])
+        except (ValueError, KeyError):
+            retry_after = float(response.headers.get("Retry-After", 1))
+        return False, retry_after
+
+    if response.status_code >= 500:
+        return False, 0
+
+    if response.status_code >= 400:
+        # Retrying won't fix a message Discord refuses
+        logging.error(f"Discord refused message with {response.status_code}: {response.text}")
+
+    return True, None
+
+class NotificationQueue:
+    """
+    Sends queued embeds from a background thread, packing up to MAX_EMBEDS into each message.
+
+    Rate limits (429) and server errors are retried with backoff, undelivered
+    embeds are kept in a file so they survive a crash. Without a filename
+    they are only kept in memory.
+
+    The file is a journal with one JSON line per queued embed or delivered batch,
+    so queueing costs the same however much is waiting. The worker rewrites it
+    with just the undelivered embeds once it grew to twice their number.
+
+    Processes running side by side share the file. It is only changed under
+    <file>.lock, and only the process holding <file>.sender delivers: it reads
+    what the others append and is the only one to record deliveries or rewrite
+    the file. The others leave their embeds to it, it lets go only after finding
+    nothing left with the file locked, so nothing is sent twice or left behind.
+    """
+    def __init__(self, webhook_url: str, filename: str, sender = send_webhook):
+        self.webhook_url = webhook_url
+        self.filename = filename
+        self.sender = sender
+        self.condition = threading.Condition()
+        self.flushing = False # No lingering, close is waiting
+        self.closing = False
+        self.worker = None
+        self.pending = []
+        self.unsent = False # Embeds were added to the file since the worker last read it
+        self.offset = 0 # Bytes of the file read into pending
+        self.journal_lines = 0
+        self.sending = None # The open <file>.sender while this process delivers
+
+        if self.filename != None:
+            with self.locked():
+                self.load()
+
+        if len(self.pending) > 0:
+            logging.info(f"Resending {len(self.pending)} undelivered Discord messages")
+            self.start()
+
+    def locked(self):
+        """
+        Holds the lock every change to the file is made under
+        """
+        if self.filename == None:
+            return contextlib.nullcontext(True)
+
+        return store.file_lock(self.filename + ".lock")
+
+    def load(self):
+        """
+        Reads the whole file into pending, call with the file locked. Queue files from
+        before the journal (a JSON list) are rewritten as one.
+        """
+        self.pending = []
+        self.offset = 0
+        self.journal_lines = 0
+
+        try:
+            with open(self.filename, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+
+        if not data.startswith(b"["):
+            self.replay(data)
+            return
+
+        try:
+            self.pending = json.loads(data)
+        except ValueError as e:
+            logging.warning(f"Broken Discord queue {self.filename}: {e}")
+
+        with store.replacing(self.filename, "wb") as file:
+            for embed in self.pending:
+                file.write(encode({"embed": embed}))
+
+        self.offset = os.path.getsize(self.filename)
+        self.journal_lines = len(self.pending)
+
+    def refresh(self):
+        """
+        Reads what was appended since the last read, call as the sender with the file locked
+        """
+        if self.filename == None:
+            return
+
+        try:
+            with open(self.filename, "rb") as file:
+                file.seek(self.offset)
+                data = file.read()
+        except FileNotFoundError:
+            return
+
+        self.replay(data)
+
+    def replay(self, data: bytes):
+        """
+        Applies journal lines read from the file at offset, call with the file locked
+        """
+        end = data.rfind(b"\n") + 1
+
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logging.warning(f"Skipping broken line in Discord queue {self.filename}")
+                continue
+
+            if "embed" in entry.keys():
+                self.pending.append(entry["embed"])
+            else:
+                del self.pending[:entry["delivered"]]
+
+        self.journal_lines += data.count(b"\n", 0, end)
+        self.offset += end
+
+        # Whole lines are written under the lock, so the rest was cut short by a crash.
+        # Appending after it would break the next line as well.
+        if end < len(data):
+            logging.warning(f"Dropping the unfinished last line of Discord queue {self.filename}")
+            os.truncate(self.filename, self.offset)
+
+    def append(self, entry: dict):
+        """Adds a line to the file, call with the file locked
+
+        Args:
+            entry (dict): {"embed": ...} or {"delivered": count}
+
+        Returns:
+            int: Bytes written
+        """
+        line = encode(entry)
+
+        with open(self.filename, "ab") as file:
+            file.write(line)
+
+        return len(line)
+
+    def compact(self):
+        """
+        Atomically rewrites the file with only the undelivered embeds, only the sender does this.
+
+        The embeds waiting when it starts are written and synced without holding any lock,
+        only the ones queued in the meantime are added while puts wait. Nothing else
+        delivers until the sender is done, so what is waiting can only grow until then.
+        """
+        with self.condition:
+            with self.locked():
+                self.refresh()
+            snapshot = list(self.pending)
+
+        file, temporary = store.temporary(self.filename, "wb")
+
+        try:
+            with file:
+                for embed in snapshot:
+                    file.write(encode({"embed": embed}))
+                file.flush()
+                os.fsync(file.fileno())
+
+                with self.condition, self.locked():
+                    self.refresh()
+
+                    for embed in self.pending[len(snapshot):]:
+                        file.write(encode({"embed": embed}))
+                    file.flush()
+
+                    os.replace(temporary, self.filename)
+                    self.offset = file.tell()
+                    self.journal_lines = len(self.pending)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temporary)
+            raise
+
+    def acquire(self):
+        """
+        Tries to become the process that delivers, always succeeds without a file
+        """
+        if self.filename == None:
+            return True
+
+        file = open(self.filename + ".sender", "a")
+
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+
+        self.sending = file
+        return True
+
+    def release(self):
+        """
+        Lets another process deliver, call with the file locked
+        """
+        if self.sending != None:
+            fcntl.flock(self.sending, fcntl.LOCK_UN)
+            self.sending.close()
+            self.sending = None
+
+    def start(self):
+        if self.worker == None:
+            self.worker = threading.Thread(target = self.run, name = "discord", daemon = True)
+            self.worker.start()
+
+    def put(self, embed: dict):
+        with self.condition:
+            if self.filename == None:
+                self.pending.append(embed)
+            else:
+                with self.locked():
+                    self.append({"embed": embed})
+                self.unsent = True
+
+            self.condition.notify()
+
+        self.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0 and not self.unsent and not self.closing:
+                    self.condition.wait()
+
+                if self.closing:
+                    return
+
+            if self.acquire():
+                self.deliver()
+                continue
+
+            # Another process delivers, it reads what this one queued from the file
+            with self.condition:
+                self.pending = []
+                self.unsent = False
+                self.condition.notify_all()
+
+    def deliver(self):
+        """
+        Sends until nothing is left or the queue closes, then releases the sender lock
+        """
+        backoff = 1
+
+        # The previous sender may have rewritten the file
+        with self.condition:
+            if self.filename != None:
+                with self.locked():
+                    self.load()
+            self.unsent = False
+
+        while True:
+            with self.condition:
+                if 0 < len(self.pending) < MAX_EMBEDS and not self.flushing and not self.closing:
+                    self.condition.wait(LINGER)
+
+                with self.locked():
+                    self.refresh()
+                    self.unsent = False
+
+                    if len(self.pending) == 0 or self.closing:
+                        self.release()
+                        self.condition.notify_all()
+                        return
+
+                batch = self.pending[:MAX_EMBEDS]
+
+            delivered, retry_after = self.sender(self.webhook_url, batch)
+
+            if delivered:
+                backoff = 1
+
+                with self.condition:
+                    del self.pending[:len(batch)]
+
+                    if self.filename != None:
+                        with self.locked():
+                            self.refresh()
+                            self.offset += self.append({"delivered": len(batch)})
+                            self.journal_lines += 1
+
+                    compact = self.filename != None and self.journal_lines > 2 * len(self.pending) + COMPACT_SLACK
+                    self.condition.notify_all()
+
+                # Puts go on while the file is rewritten
+                if compact:
+                    self.compact()
+                continue
+
+            delay = max(retry_after, backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            logging.warning(f"Discord message not delivered, retrying in {delay:.1f}s")
+
+            with self.condition:
+                # Puts and close wake the condition, the delay still has to pass
+                resume = time.monotonic() + delay
+
+                while not self.closing and (remaining := resume - time.monotonic()) > 0:
+                    self.condition.wait(remaining)
+
+    def close(self, timeout: float = 10):
+        """
+        Gives the worker up to timeout seconds to deliver what's left, the rest stays in the file
+        """
+        deadline = time.monotonic() + timeout
+
+        with self.condition:
+            self.flushing = True
+            self.condition.notify_all()
+
+            while (len(self.pending) > 0 or self.unsent) and self.worker != None and self.worker.is_alive() \
+            and (remaining := deadline - time.monotonic()) > 0:
+                self.condition.wait(remaining)
+
+            self.closing = True
+            self.condition.notify_all()
+
+        # Lets a rewrite of the file finish, a send keeps going in the background
+        if self.worker != None:
+            self.worker.join(max(deadline - time.monotonic(), 1))
+
+        if len(self.pending) > 0:
+            logging.warning(f"{len(self.pending)} Discord messages left undelivered, they will be sent on the next start")
+
+def encode(entry: dict):
+    """Turns a journal entry into its line
+
+    Args:
+        entry (dict): {"embed": ...} or {"delivered": count}
+
+    Returns:
+        bytes: The line
+    """
+    return (json.dumps(entry) + "\n").encode("utf-8")
+
+def get_queue(webhook_url: str, filename: str = "discord_queue.json", sender = send_webhook):
+    """Returns the shared queue of a webhook
+
+    Args:
+        webhook_url (str): The webhook
+        filename (str): Where undelivered messages are kept, None keeps them in memory only
+        sender: Sends a batch of embeds, only used when the queue is created
+
+    Returns:
+        NotificationQueue: The queue
+    """
+    if not webhook_url in _queues.keys():
+        _queues[webhook_url] = NotificationQueue(webhook_url, filename, sender)
+
+    return _queues[webhook_url]
+
+def close_all(timeout: float = 10):
+    """Flushes and closes every queue
+
+    Args:
+        timeout (float): Seconds each queue may take to deliver what's left
+    """
+    for queue in _queues.values():
+        queue.close(timeout)
+
+    _queues.clear()
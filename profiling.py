@@ -0,0 +1,223 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+"""
+Per-phase profiles of a run, for "main.py --profile DIR".
+
+The phases are the ones metrics.timed already measures. Each one gets its own
+cProfile capture (a phase running inside another one is only counted in the
+inner capture) and a sampling thread records the stacks of every busy thread
+while a phase runs, which also covers the comment fetching workers cProfile
+doesn't see. For every phase DIR gets:
+
+    <phase>.pstats      for pstats, snakeviz and friends
+    <phase>.collapsed   for flamegraph.pl, speedscope or inferno
+    report.txt          the top hotspots and the time spent in dateparser and praw
+
+The time spent in a package including what it called comes from the samples
+(their share times the length of the phase), its own code is timed by cProfile.
+"""
+
+import collections
+import contextlib
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+PHASES = ("ingest", "schedule_build", "publish", "posting")
+PACKAGES = ("dateparser", "praw", "prawcore")
+
+# Threads parked here are waiting, not working
+IDLE_MODULES = ("threading", "queue", "selectors")
+
+class Capture:
+    """
+    What was recorded for one phase
+    """
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.stacks = collections.Counter()
+        self.runs = 0
+        self.seconds = 0.0
+
+class Profiler:
+    def __init__(self, directory: str, phases: tuple = PHASES, interval: float = 0.005):
+        self.directory = directory
+        self.phases = phases
+        self.interval = interval
+
+        self.captures = {}
+        self.active = [] # Names of the phases running right now, innermost last
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        self.sampler = threading.Thread(target = self.sample, name = "profiling-sampler", daemon = True)
+        self.sampler.start()
+
+    @contextlib.contextmanager
+    def capture(self, phase: str):
+        """
+        Profiles a block as the given phase, other phases aren't captured
+        """
+        if not phase in self.phases or threading.current_thread() != threading.main_thread():
+            yield
+            return
+
+        capture = self.captures.setdefault(phase, Capture())
+        outer = self.captures[self.active[-1]] if self.active else None
+
+        if outer != None:
+            outer.profile.disable()
+
+        with self.lock:
+            self.active.append(phase)
+
+        start = time.perf_counter()
+        capture.profile.enable()
+        try:
+            yield
+        finally:
+            capture.profile.disable()
+            capture.runs += 1
+            capture.seconds += time.perf_counter() - start
+
+            with self.lock:
+                self.active.pop()
+
+            if outer != None:
+                outer.profile.enable()
+
+    def sample(self):
+        """
+        Records the stacks of all busy threads under the innermost running phase
+        """
+        own = threading.get_ident()
+
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                if not self.active:
+                    continue
+                capture = self.captures[self.active[-1]]
+
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for ident, frame in sys._current_frames().items():
+                if ident == own or frame.f_globals.get("__name__") in IDLE_MODULES:
+                    continue
+
+                stack = []
+                while frame != None:
+                    code = frame.f_code
+                    stack.append(f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}".replace(";", ":"))
+                    frame = frame.f_back
+
+                stack.append(names.get(ident, str(ident)).replace(";", ":").replace(" ", "_"))
+                capture.stacks[";".join(reversed(stack))] += 1
+
+    def write(self):
+        """Stops sampling and writes the captures and the report
+
+        Returns:
+            str: Path of the report
+        """
+        self.stopped.set()
+        self.sampler.join()
+        os.makedirs(self.directory, exist_ok = True)
+
+        report = []
+
+        for phase, capture in self.captures.items():
+            capture.profile.dump_stats(os.path.join(self.directory, f"{phase}.pstats"))
+
+            with open(os.path.join(self.directory, f"{phase}.collapsed"), "w") as file:
+                for stack, count in sorted(capture.stacks.items()):
+                    file.write(f"{stack} {count}\n")
+
+            report += phase_report(phase, capture)
+
+            # The log only gets the summaries, the hotspots are in the report
+            for line in phase_report(phase, capture, top = 0):
+                logging.info(line)
+
+        path = os.path.join(self.directory, "report.txt")
+        with open(path, "w") as file:
+            file.write("\n".join(report) + "\n")
+
+        logging.info(f"Profiles written to {self.directory}, hotspots in {path}")
+
+        return path
+
+def in_package(filename: str, package: str):
+    """Checks if a source file belongs to an installed package
+
+    Args:
+        filename (str): Path from a code object
+        package (str): Top level package name
+
+    Returns:
+        bool: True if the file is part of the package
+    """
+    return f"{os.sep}{package}{os.sep}" in filename
+
+def package_own_time(stats: dict, package: str):
+    """Sums up the time a profile spent in the own code of a package
+
+    Args:
+        stats (dict): pstats.Stats.stats of a profile
+        package (str): Top level package name
+
+    Returns:
+        float: Seconds in functions of the package, not counting what they called
+    """
+    return sum(own for (filename, _, _), (_, _, own, _, _) in stats.items() if in_package(filename, package))
+
+def phase_report(phase: str, capture: Capture, top: int = 15):
+    """Renders the report of one phase
+
+    Args:
+        phase (str): Name of the phase
+        capture (Capture): What was recorded
+        top (int): How many functions to list
+
+    Returns:
+        list: Lines of the report
+    """
+    stats = pstats.Stats(capture.profile).stats
+    samples = sum(capture.stacks.values())
+
+    lines = [f"== {phase}: {capture.runs} runs, {capture.seconds:.3f}s, {samples} samples",
+             f"{'package':<12} {'inclusive':>10} {'own':>10} {'samples':>8}"]
+
+    for package in PACKAGES:
+        hits = sum(count for stack, count in capture.stacks.items()
+                   if any(frame.split(".", 1)[0] == package for frame in stack.split(";")[1:]))
+        share = hits / samples if samples > 0 else 0.0
+
+        # cProfile's cumulative times count nested imports (entered through exec) once per level,
+        # the samples have every moment in the package exactly once
+        inclusive = share * capture.seconds
+
+        lines.append(f"{package:<12} {inclusive:>9.3f}s {package_own_time(stats, package):>9.3f}s {share:>8.1%}")
+
+    if top > 0:
+        lines.append(f"{'own s':>9} {'cum s':>9} {'calls':>9}  function")
+
+    hotspots = sorted(stats.items(), key = lambda item: item[1][2], reverse = True)[:top]
+    for (filename, line, name), (_, calls, own, cumulative, _) in hotspots:
+        lines.append(f"{own:>9.3f} {cumulative:>9.3f} {calls:>9}  {name} ({os.path.basename(filename)}:{line})")
+
+    return lines
@@ -0,0 +1,226 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+"""
+Typed records for the db.
+
+On disk the old db.json layout is kept: one dict per post with marker keys
+(EMERGENCY, WORK_IN_PROGRESS, IS_READY, ...) next to upper case control keys.
+Post bodies live in the blob store, a post only keeps a preview and the hash.
+"""
+
+import datetime
+import enum
+
+class PostState(enum.Enum):
+    """
+    The flair a draft had when it was last seen
+    """
+    BOT_READY = "BOT READY"
+    EMERGENCY = "EMERGENCY READY"
+    WORK_IN_PROGRESS = "WORK IN PROGRESS"
+
+class Post:
+    """
+    A draft in the queue
+    """
+    __slots__ = ("author", "sub", "title", "preview", "text_hash", "date", "state", "ready",
+                 "announced", "definitely_announced", "fingerprint", "extra")
+
+    def __init__(self):
+        self.author = None
+        self.sub = None
+        self.title = None
+        self.preview = None
+        self.text_hash = None # Key of the body in the blob store
+        self.date = None # datetime.date
+        self.state = PostState.BOT_READY
+        self.ready = False
+        self.announced = False
+        self.definitely_announced = False
+        self.fingerprint = None
+        self.extra = None # Unknown keys from old files (and bodies not moved out yet), written back untouched
+
+    @property
+    def emergency(self):
+        return self.state == PostState.EMERGENCY
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        post = cls()
+        data = dict(data)
+
+        if "EMERGENCY" in data.keys():
+            post.state = PostState.EMERGENCY
+        elif "WORK_IN_PROGRESS" in data.keys():
+            post.state = PostState.WORK_IN_PROGRESS
+
+        post.ready = "IS_READY" in data.keys()
+        post.definitely_announced = "DEFINITELY_ANNOUNCED" in data.keys()
+        post.announced = bool(data.pop("ANNOUNCED", False))
+        post.fingerprint = data.pop("FINGERPRINT", None)
+
+        for key in ("EMERGENCY", "WORK_IN_PROGRESS", "IS_READY", "DEFINITELY_ANNOUNCED"):
+            data.pop(key, None)
+
+        post.author = data.pop("author", None)
+        post.sub = data.pop("sub", None)
+        post.title = data.pop("title", None)
+        post.preview = data.pop("preview", None)
+        post.text_hash = data.pop("text_hash", None)
+
+        if (dt := data.pop("date", None)) != None:
+            post.date = datetime.date(dt["year"], dt["month"], dt["day"])
+
+        post.extra = data if len(data) > 0 else None
+
+        return post
+
+    def to_dict(self):
+        data = dict(self.extra) if self.extra != None else {}
+
+        for key in ("author", "sub", "title", "preview", "text_hash"):
+            if (value := getattr(self, key)) != None:
+                data[key] = value
+
+        if self.date != None:
+            data["date"] = {"day": self.date.day, "month": self.date.month, "year": self.date.year}
+
+        if self.state == PostState.EMERGENCY:
+            data["EMERGENCY"] = None
+        elif self.state == PostState.WORK_IN_PROGRESS:
+            data["WORK_IN_PROGRESS"] = None
+
+        if self.ready:
+            data["IS_READY"] = None
+
+        data["ANNOUNCED"] = self.announced
+
+        if self.definitely_announced:
+            data["DEFINITELY_ANNOUNCED"] = True
+
+        if self.fingerprint != None:
+            data["FINGERPRINT"] = self.fingerprint
+
+        return data
+
+class Control:
+    """
+    Bot state that isn't tied to a single post
+    """
+    KEYS = {
+        "next_post": "NEXT_POST",
+        "last_post_day": "LAST_POST_DAY",
+        "has_posted_about_no_sub": "HAS_POSTED_ABOUT_NO_SUB",
+        "schedule_hash": "SCHEDULE_HASH",
+        "schedule_comments": "SCHEDULE_COMMENTS",
+        "comment_cursor": "COMMENT_CURSOR",
+        "backfill_after": "BACKFILL_AFTER",
+        "last_post_utc": "LAST_POST_UTC"
+    }
+
+    __slots__ = tuple(KEYS.keys()) + ("extra",)
+
+    def __init__(self):
+        for attribute in self.KEYS.keys():
+            setattr(self, attribute, None)
+        self.extra = {}
+
+    def get(self, key: str):
+        """
+        Returns the value stored under an on-disk key
+        """
+        if key in CONTROL_ATTRIBUTES.keys():
+            return getattr(self, CONTROL_ATTRIBUTES[key])
+        return self.extra.get(key)
+
+    def set(self, key: str, value):
+        if key in CONTROL_ATTRIBUTES.keys():
+            setattr(self, CONTROL_ATTRIBUTES[key], value)
+        elif value == None:
+            self.extra.pop(key, None)
+        else:
+            self.extra[key] = value
+
+CONTROL_ATTRIBUTES = {key: attribute for attribute, key in Control.KEYS.items()}
+CONTROL_KEYS = tuple(CONTROL_ATTRIBUTES.keys())
+
+def from_db(data: dict):
+    """Splits an on-disk db into posts and control state
+
+    Args:
+        data (dict): The db in the db.json layout
+
+    Returns:
+        tuple: (dict of post id -> Post, Control)
+    """
+    posts = {}
+    control = Control()
+
+    for key, value in data.items():
+        if isinstance(value, dict) and not key in CONTROL_KEYS:
+            posts[key] = Post.from_dict(value)
+        else:
+            control.set(key, value)
+
+    return posts, control
+
+def to_db(posts: dict, control: Control, keys: list = None):
+    """Builds the on-disk layout of the db
+
+    Args:
+        posts (dict): Post id -> Post
+        control (Control): The control state
+        keys (list): Only include these post ids / control keys
+
+    Returns:
+        dict: The db in the db.json layout, missing keys were deleted
+    """
+    data = {}
+
+    if keys == None:
+        keys = list(CONTROL_KEYS) + list(control.extra.keys()) + list(posts.keys())
+
+    for key in keys:
+        if key in posts.keys():
+            data[key] = posts[key].to_dict()
+        elif (value := control.get(key)) != None:
+            data[key] = value
+
+    return data
+
+def apply(posts: dict, control: Control, key: str, value):
+    """Puts a single on-disk entry into posts and control state
+
+    Posts that are already loaded are updated in place, so references to them stay valid.
+
+    Args:
+        posts (dict): Post id -> Post
+        control (Control): The control state
+        key (str): Post id or control key
+        value: The entry in the db.json layout, None if it was deleted
+    """
+    if value == None:
+        posts.pop(key, None)
+        control.set(key, None)
+    elif isinstance(value, dict) and not key in CONTROL_KEYS:
+        post = Post.from_dict(value)
+
+        if not key in posts.keys():
+            posts[key] = post
+            return
+
+        for slot in Post.__slots__:
+            setattr(posts[key], slot, getattr(post, slot))
+    else:
+        control.set(key, value)
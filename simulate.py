@@ -0,0 +1,189 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+"""
+Fast-forwards the scan, schedule and posting pipeline day by day against fakereddit.
+
+Writers hand in drafts at a given rate, each one claiming a day some time ahead,
+a share of them as emergency posts. Every simulated day the bot runs once at
+noon like the systemd timer would, and the flair of a posted draft is removed
+like our moderators do by hand. Nothing leaves the machine.
+
+    python simulate.py --days 365 --rate 0.9 --emergency 0.15
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+import clock
+import fakereddit
+import main
+import notify
+
+def submit_drafts(reddit: fakereddit.FakeReddit, rng: random.Random, count: int, emergency: float, lead: tuple, numbers):
+    """Hands in the drafts our writers finished today
+
+    Args:
+        reddit (fakereddit.FakeReddit): The fake
+        rng (random.Random): Source of randomness
+        count (int): How many drafts
+        emergency (float): Share of emergency posts
+        lead (tuple): Fewest and most days between handing in a draft and its day
+        numbers: Iterator of unique subreddit numbers
+    """
+    for _ in range(count):
+        number = next(numbers)
+
+        if rng.random() < emergency:
+            reddit.add_submission("srotd_dev", f"r/sim{number}: Emergency post", "Emergency text. " * 50,
+                                  link_flair_text = "EMERGENCY READY", author = f"writer{number % 10}")
+            continue
+
+        day = clock.now() + datetime.timedelta(days = rng.randint(*lead))
+        reddit.add_submission("srotd_dev", f"r/sim{number}: {day.strftime('%B')} {day.day}", "Write-up. " * 200,
+                              link_flair_text = "BOT READY", author = f"writer{number % 10}")
+
+def simulate(days: int, rate: float, emergency: float, lead: tuple, seed: int):
+    """Runs the bot once a day for days days
+
+    Args:
+        days (int): Simulated days
+        rate (float): Drafts handed in per day on average
+        emergency (float): Share of emergency posts among them
+        lead (tuple): Fewest and most days between handing in a draft and its day
+        seed (int): Seed for reproducible runs
+
+    Returns:
+        dict: The report
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime.combine(clock.today(), datetime.time(9))
+    fake_clock = clock.FakeClock(start)
+    previous = clock.use(fake_clock)
+
+    reddit = fakereddit.FakeReddit()
+    sink = fakereddit.FakeWebhookSink()
+    reddit.add_submission("srotd_dev", "Schedule", "Our schedule\n", id = main.update_post_id)
+    target = reddit.subreddit("subredditoftheday")
+
+    numbers = iter(range(10 ** 9))
+    report = {"days": days, "posted": 0, "emergency_posts": 0, "gaps": 0, "longest_gap": 0,
+              "expired_drafts": 0, "drafts": 0, "queue_at_end": 0, "gap_days": []}
+    gap = 0
+    expired = set()
+
+    try:
+        notify.get_queue(main.discord_webhook, filename = None, sender = sink)
+        handler = main.Reddit_Handler(reddit)
+
+        for i in range(days):
+            fake_clock.set(start + datetime.timedelta(days = i))
+
+            count = int(rate) + (1 if rng.random() < rate - int(rate) else 0)
+            submit_drafts(reddit, rng, count, emergency, lead, numbers)
+            report["drafts"] += count
+
+            # The bot runs shortly after noon, when posting is allowed
+            fake_clock.advance(hours = 3, minutes = 30)
+            today = clock.today()
+
+            handler.tsrotd.check_for_new_posts()
+            handler.tsrotd.create_schedule()
+
+            # Drafts whose day passed without them going out
+            expired.update(post_id for post_id, post in main.db.items()
+                           if post.date != None and post.date < today and not post.emergency)
+
+            next_post_id = main.control.next_post
+            next_post = main.db.get(next_post_id)
+            posts_before = len(target.submissions)
+
+            handler.tsrotd.post_handling()
+
+            if len(target.submissions) > posts_before:
+                # Moderators take the flair off a draft once it went out
+                reddit.submissions[next_post_id].link_flair_text = None
+
+                report["posted"] += 1
+                report["emergency_posts"] += 1 if next_post != None and next_post.emergency else 0
+                gap = 0
+            else:
+                report["gaps"] += 1
+                report["gap_days"].append(today.isoformat())
+                gap += 1
+                report["longest_gap"] = max(report["longest_gap"], gap)
+
+        report["expired_drafts"] = len(expired)
+        report["queue_at_end"] = len(main.db)
+        report["emergency_queue_at_end"] = sum(1 for post in main.db.values() if post.emergency)
+        handler.exit()
+    finally:
+        clock.use(previous)
+
+    report["fill_rate"] = report["posted"] / days if days > 0 else 0.0
+    report["emergency_share"] = report["emergency_posts"] / report["posted"] if report["posted"] > 0 else 0.0
+    report["api_calls"] = dict(reddit.calls)
+
+    return report
+
+def main_simulate():
+    parser = argparse.ArgumentParser(description = "Offline simulation of the SROTD schedule over many days")
+    parser.add_argument("--days", type = int, default = 365, help = "days to simulate")
+    parser.add_argument("--rate", type = float, default = 1.0, help = "drafts handed in per day")
+    parser.add_argument("--emergency", type = float, default = 0.15, help = "share of emergency posts among the drafts")
+    parser.add_argument("--lead", type = int, nargs = 2, default = [3, 45], metavar = ("MIN", "MAX"),
+                        help = "days between handing in a draft and the day it claims")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed for reproducible runs")
+    parser.add_argument("--json", help = "also write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.ERROR, format = "%(asctime)s [%(levelname)s] %(message)s")
+
+    # Nothing leaves the process, so the PROD code paths can be simulated as well
+    main.DEV = False
+    main.STORE_FILE = ":memory:"
+
+    # Nobody edits a comment here, unchanged drafts only need a rescan for the year rollover
+    main.FINGERPRINT_HOURS = None
+
+    cwd = os.getcwd()
+    wall = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            report = simulate(args.days, args.rate, args.emergency, tuple(args.lead), args.seed)
+        finally:
+            os.chdir(cwd)
+
+    report["wall_s"] = time.perf_counter() - wall
+
+    print(f"Simulated {report['days']} days with {report['drafts']} drafts in {report['wall_s']:.2f}s")
+    print(f"Fill rate        {report['fill_rate']:7.1%} ({report['posted']} posts)")
+    print(f"Emergency posts  {report['emergency_posts']:7} ({report['emergency_share']:.1%} of posts, {report['emergency_queue_at_end']} left)")
+    print(f"Days without     {report['gaps']:7} (longest streak {report['longest_gap']})")
+    print(f"Expired drafts   {report['expired_drafts']:7} (their day passed without them)")
+    print(f"Queue at end     {report['queue_at_end']:7}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent = 2)
+
+if __name__ == "__main__":
+    main_simulate()
@@ -0,0 +1,113 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+"""
+Read-only status API of "main.py --daemon" on 127.0.0.1.
+
+The bot publishes a snapshot after every duty, the documents are serialized once
+and served as they are, so requests never touch the db or reddit:
+
+    /                   the available paths
+    /status             every tenant and the metrics
+    /tenants/<name>     schedule plan, posts and NEXT_POST of one tenant
+    /metrics            the metrics summary of the last run
+
+Every response carries an ETag, a matching If-None-Match gets a 304.
+"""
+
+import hashlib
+import http.server
+import json
+import logging
+import threading
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    server_version = "srotd-status"
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def respond(self, send_body: bool):
+        document = self.server.documents.get(self.path.split("?", 1)[0].rstrip("/") or "/")
+
+        if document == None:
+            self.send_error(404)
+            return
+
+        body, etag = document
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+        if etag in [tag.strip().removeprefix("W/") for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            body = b""
+        else:
+            self.send_response(200)
+            headers["Content-Type"] = "application/json"
+            headers["Content-Length"] = str(len(body))
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        logging.debug(f"Status API: {format % args}")
+
+class StatusServer:
+    def __init__(self, port: int, host: str = "127.0.0.1"):
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.documents = {}
+
+        self.thread = threading.Thread(target = self.httpd.serve_forever, name = "status-api", daemon = True)
+        self.thread.start()
+
+        logging.info(f"Status API listening on http://{host}:{self.httpd.server_port}/")
+
+    def publish(self, tenants: dict, metrics_summary: dict):
+        """Replaces the served documents
+
+        Args:
+            tenants (dict): Tenant name -> status document
+            metrics_summary (dict): See metrics.Metrics.summary
+        """
+        documents = {
+            "/status": {"tenants": tenants, "metrics": metrics_summary},
+            "/metrics": metrics_summary
+        }
+        documents.update({f"/tenants/{name}": document for name, document in tenants.items()})
+        documents["/"] = {"paths": sorted(documents.keys())}
+
+        # Swapping the whole dict is atomic, requests see either the old or the new snapshot
+        self.httpd.documents = {path: encode(document) for path, document in documents.items()}
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def encode(document):
+    """Serializes a document once for all requests
+
+    Args:
+        document: Anything json can dump
+
+    Returns:
+        tuple: The body and its ETag
+    """
+    body = json.dumps(document, default = str).encode("utf-8")
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
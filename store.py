@@ -0,0 +1,603 @@
+###
+# Copyright 2021-2024 AnnsAnn, git@annsann.eu
+#
+# Licensed under the EUPL, Version 1.2 or – as soon they will be approved by the European Commission - subsequent versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with theLicence.
+#
+# You may obtain a copy of the Licence at: https://joinup.ec.europa.eu/software/page/eupl
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the Licence is distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the Licence for the specific language governing permissions and limitations under the Licence.
+###
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+import records
+
+def load_json(filename: str):
+    """Loads a JSON db, broken files are moved aside instead of being overwritten later on
+
+    Args:
+        filename (str): The db file
+
+    Returns:
+        dict: The db, empty if there was none
+    """
+    try:
+        with open(filename, "r") as file:
+            return json.load(file)
+    except FileNotFoundError as e:
+        logging.warning(f"Error opening db: {e} - Returning no DB")
+        return {}
+    except ValueError as e:
+        logging.critical(f"Broken db file detected: {e} - Moving it to {filename}.broken")
+        os.replace(filename, filename + ".broken")
+        return {}
+
+def temporary(filename: str, mode: str = "w"):
+    """Creates a file next to another one to write its replacement into
+
+    Every writer gets its own file, so processes replacing the same file at once
+    don't pull it out from under each other, the last one to finish wins.
+
+    Args:
+        filename (str): The file to replace
+        mode (str): "w" or "wb"
+
+    Returns:
+        tuple: The open file and its path, for os.replace
+    """
+    descriptor, path = tempfile.mkstemp(dir = os.path.dirname(filename) or ".",
+                                        prefix = os.path.basename(filename) + ".", suffix = ".tmp")
+
+    # mkstemp only lets the owner read, the replacement keeps the permissions of the file
+    os.chmod(path, os.stat(filename).st_mode & 0o777 if os.path.exists(filename) else 0o644)
+
+    return os.fdopen(descriptor, mode), path
+
+@contextlib.contextmanager
+def replacing(filename: str, mode: str = "w", sync: bool = True):
+    """Writes a file atomically, a crash mid-write leaves the old one intact
+
+    Args:
+        filename (str): The file to replace
+        mode (str): "w" or "wb"
+        sync (bool): Flush the data to disk before the file is replaced
+
+    Yields:
+        file: The replacement, it takes the place of filename if the block finishes
+    """
+    file, path = temporary(filename, mode)
+
+    try:
+        with file:
+            yield file
+            file.flush()
+            if sync:
+                os.fsync(file.fileno())
+        os.replace(path, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+        raise
+
+def save_json(db: dict, filename: str):
+    """Atomically replaces a JSON db, a crash mid-write leaves the old file intact
+
+    Args:
+        db (dict): The db
+        filename (str): The db file
+    """
+    with replacing(filename) as file:
+        json.dump(db, file)
+
+def post_state(post: dict):
+    """Returns the state of a post as stored in the state column
+
+    Args:
+        post (dict): The post
+
+    Returns:
+        str: EMERGENCY, WORK_IN_PROGRESS, READY or DRAFT
+    """
+    if "EMERGENCY" in post.keys():
+        return "EMERGENCY"
+    if "WORK_IN_PROGRESS" in post.keys():
+        return "WORK_IN_PROGRESS"
+    if "IS_READY" in post.keys():
+        return "READY"
+    return "DRAFT"
+
+def post_scheduled(post: dict):
+    """Returns the scheduled date of a post as stored in the scheduled column
+
+    Args:
+        post (dict): The post
+
+    Returns:
+        None or str: ISO date
+    """
+    if not "date" in post.keys():
+        return None
+
+    dt = post["date"]
+    return f"{dt['year']:04d}-{dt['month']:02d}-{dt['day']:02d}"
+
+def merge_entry(base, ours, theirs):
+    """Three-way merge of one db entry that was changed by this and another process
+
+    Args:
+        base: The entry as this process last loaded or saved it
+        ours: The entry as this process has it now
+        theirs: The entry as it is stored now
+
+    Returns:
+        The entry to keep, None if it is deleted
+    """
+    if theirs == base:
+        return ours
+    if ours == base:
+        return theirs
+
+    # Posts are only deleted once they went out or turned out to be ghosts, they must not come back
+    if ours == None or theirs == None:
+        return None
+
+    if not isinstance(ours, dict) or not isinstance(theirs, dict):
+        # Control values have nothing to merge, the newer decision wins
+        return ours
+
+    base = base if isinstance(base, dict) else {}
+    merged = dict(theirs)
+
+    # Post fields this process changed win, the others keep what the other process stored
+    for field in set(ours.keys()) | set(base.keys()):
+        if not field in ours.keys():
+            merged.pop(field, None)
+        elif not field in base.keys() or base[field] != ours[field]:
+            merged[field] = ours[field]
+
+    return merged
+
+def reconcile(saved: dict, ours: dict, current: dict, keys):
+    """Merges the entries another process changed since this one last loaded or saved them
+
+    Args:
+        saved (dict): Key -> JSON of the entry as this process last loaded or saved it
+        ours (dict): The db in the db.json layout as this process has it now, missing keys are deleted
+        current (dict): Key -> JSON of the entry as it is stored now
+        keys: Keys to look at
+
+    Returns:
+        dict: Key -> merged entry (None if deleted) for every key that was changed by another process
+    """
+    def decode(data):
+        return json.loads(data) if data != None else None
+
+    merged = {}
+
+    for key in keys:
+        if current.get(key) == saved.get(key):
+            continue
+
+        merged[key] = merge_entry(decode(saved.get(key)), ours.get(key), decode(current.get(key)))
+
+    if len(merged) > 0:
+        logging.info(f"Merged {len(merged)} db entries changed by another process")
+
+    return merged
+
+def take_over(saved: dict, current: dict, db: dict, control: records.Control):
+    """Brings the posts and control state up to date with the stored db, keeping what this process changed
+
+    Args:
+        saved (dict): Key -> JSON as this process last loaded or saved it, becomes current
+        current (dict): Key -> JSON as stored now
+        db (dict): Post id -> Post
+        control (records.Control): The control state
+    """
+    keys = [key for key in set(saved.keys()) | set(current.keys()) if saved.get(key) != current.get(key)]
+
+    for key, entry in reconcile(saved, records.to_db(db, control, keys), current, keys).items():
+        records.apply(db, control, key, entry)
+
+    saved.clear()
+    saved.update(current)
+
+@contextlib.contextmanager
+def file_lock(path: str, blocking: bool = True):
+    """Holds an exclusive lock on a file, shared between every process on the machine
+
+    Args:
+        path (str): The lock file, created if missing
+        blocking (bool): Wait for another process to release the lock instead of giving up
+
+    Yields:
+        bool: False if the lock is held elsewhere and blocking is off
+    """
+    with open(path, "a") as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+PREVIEW_LENGTH = 100
+
+class BlobStore:
+    """
+    Keeps post bodies zlib-compressed in files named after the sha256 of the text.
+
+    A body is only written when no file for its hash exists yet, so unchanged
+    bodies are never rewritten and nothing is read until a body is needed.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, text_hash: str):
+        return os.path.join(self.directory, text_hash[:2], text_hash + ".z")
+
+    def put(self, text: str):
+        """
+        Stores a body and returns its hash
+        """
+        data = text.encode("utf-8")
+        text_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(text_hash)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+
+            with replacing(path, "wb") as file:
+                file.write(zlib.compress(data))
+
+        return text_hash
+
+    def get(self, text_hash: str):
+        """
+        Returns a body, None if it isn't stored
+        """
+        try:
+            with open(self.path(text_hash), "rb") as file:
+                return zlib.decompress(file.read()).decode("utf-8")
+        except FileNotFoundError:
+            return None
+        except zlib.error as e:
+            logging.error(f"Broken blob {text_hash}: {e}")
+            return None
+
+    def attach(self, post: records.Post, text: str):
+        """
+        Moves the body of a post into the store, the post keeps the preview and the hash
+        """
+        post.text_hash = self.put(text)
+        post.preview = text[:PREVIEW_LENGTH]
+
+    def migrate(self, posts: dict):
+        """Moves bodies still kept in an old db into the store
+
+        Args:
+            posts (dict): Post id -> Post
+
+        Returns:
+            int: How many bodies were moved
+        """
+        moved = 0
+
+        for post in posts.values():
+            if post.extra != None and "text" in post.extra.keys():
+                self.attach(post, post.extra.pop("text"))
+                post.extra = post.extra or None
+                moved += 1
+
+        if moved > 0:
+            logging.info(f"Moved {moved} post bodies into {self.directory}")
+
+        return moved
+
+    def prune(self, keep: set, grace: float = 3600):
+        """Deletes bodies no post refers to anymore
+
+        Args:
+            keep (set): Hashes still in use
+            grace (float): Bodies younger than this many seconds are kept, they may belong to a post that isn't saved yet
+        """
+        cutoff = time.time() - grace
+        pruned = 0
+
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+
+            for entry in os.scandir(folder.path):
+                if entry.name[:-2] in keep or entry.stat().st_mtime > cutoff:
+                    continue
+
+                os.remove(entry.path)
+                pruned += 1
+
+        if pruned > 0:
+            logging.info(f"Pruned {pruned} unused post bodies")
+
+class JSONStore:
+    """
+    Keeps the whole db in a single JSON file, rewritten on every full save.
+
+    Rewriting the file for every post would make an ingest quadratic, so saves of
+    single keys wait for the next full save (the checkpoint after every duty). A
+    crash loses what the duty changed so far, the next run does it again. Saving
+    merges with what other processes wrote in the meantime, under a lock on
+    <file>.lock.
+    """
+    def __init__(self, filename: str, blobs: BlobStore):
+        self.filename = filename
+        self.blobs = blobs
+        self.saved = {}
+        self.modified = None
+
+    def stored(self):
+        """
+        Returns key -> JSON of the file as it is now
+        """
+        self.modified = os.stat(self.filename).st_mtime_ns if os.path.exists(self.filename) else None
+
+        if self.modified == None:
+            return {}
+
+        return {key: json.dumps(value) for key, value in load_json(self.filename).items()}
+
+    def load(self):
+        with file_lock(self.filename + ".lock"):
+            self.saved = self.stored()
+
+        db, control = records.from_db({key: json.loads(data) for key, data in self.saved.items()})
+        self.blobs.migrate(db)
+        return db, control
+
+    def refresh(self, db: dict, control: records.Control):
+        """
+        Takes over what other processes saved since this one last loaded or saved
+        """
+        if (os.stat(self.filename).st_mtime_ns if os.path.exists(self.filename) else None) == self.modified:
+            return
+
+        with file_lock(self.filename + ".lock"):
+            take_over(self.saved, self.stored(), db, control)
+
+    def save(self, db: dict, control: records.Control, keys: list = None):
+        # The full save writes every entry that differs from the file anyway
+        if keys != None:
+            return
+
+        ours = records.to_db(db, control)
+
+        with file_lock(self.filename + ".lock"):
+            current = self.stored()
+            merged = reconcile(self.saved, ours, current, set(ours.keys()) | set(self.saved.keys()) | set(current.keys()))
+
+            for key, entry in merged.items():
+                records.apply(db, control, key, entry)
+
+                if entry == None:
+                    ours.pop(key, None)
+                else:
+                    ours[key] = entry
+
+            save_json(ours, self.filename)
+
+            self.saved = {key: json.dumps(value) for key, value in ours.items()}
+            self.modified = os.stat(self.filename).st_mtime_ns
+
+    def lock(self, duty: str):
+        """
+        Non-blocking lock that keeps a duty from running in two processes at once, see file_lock
+        """
+        return file_lock(f"{self.filename}.{duty}.lock", blocking = False)
+
+    def close(self):
+        pass
+
+class SQLiteStore:
+    """
+    Keeps every post in its own row of a SQLite db in WAL mode.
+
+    Posts go into the posts table, the control state into the control table, both in
+    the db.json layout. Saving only writes the rows that changed since they were last
+    loaded or saved, rows another process changed in the meantime are merged.
+
+    The bot always works on every post (fingerprints, ghosts, the queue checks), so
+    the state and scheduled columns are only there for looking at the db by hand
+    and aren't indexed.
+    """
+    def __init__(self, filename: str, blobs: BlobStore, legacy_json: str = None):
+        self.filename = filename
+        self.blobs = blobs
+        self.saved = {}
+        self.data_version = None
+
+        self.connection = sqlite3.connect(filename, timeout = 30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS posts (id TEXT PRIMARY KEY, data TEXT NOT NULL, state TEXT NOT NULL, scheduled TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS control (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            # Nothing queries by them, they only slowed down every write
+            self.connection.execute("DROP INDEX IF EXISTS posts_scheduled")
+            self.connection.execute("DROP INDEX IF EXISTS posts_state")
+
+        if legacy_json != None and os.path.exists(legacy_json) and self.is_empty():
+            self.migrate(legacy_json)
+
+    def is_empty(self):
+        return self.connection.execute("SELECT NOT EXISTS (SELECT 1 FROM posts) AND NOT EXISTS (SELECT 1 FROM control)").fetchone()[0] == 1
+
+    def migrate(self, legacy_json: str):
+        """
+        One-time import of an old db.json, the file is kept as <name>.migrated
+        """
+        logging.info(f"Migrating {legacy_json} into {self.filename}")
+
+        self.write(load_json(legacy_json))
+
+        # A broken file was already moved to <name>.broken by load_json
+        if os.path.exists(legacy_json):
+            os.replace(legacy_json, legacy_json + ".migrated")
+
+    def stored(self):
+        """
+        Returns key -> JSON of every control value and post as stored now
+        """
+        self.data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+        current = dict(self.connection.execute("SELECT key, value FROM control"))
+        current.update(self.connection.execute("SELECT id, data FROM posts ORDER BY rowid"))
+
+        return current
+
+    def load(self):
+        self.saved = self.stored()
+
+        db, control = records.from_db({key: json.loads(data) for key, data in self.saved.items()})
+        self.blobs.migrate(db)
+        return db, control
+
+    def refresh(self, db: dict, control: records.Control):
+        """
+        Takes over what other processes saved since this one last loaded or saved
+        """
+        # Only changes when another connection committed something
+        if self.connection.execute("PRAGMA data_version").fetchone()[0] == self.data_version:
+            return
+
+        take_over(self.saved, self.stored(), db, control)
+
+    def save(self, db: dict, control: records.Control, keys: list = None):
+        """
+        Writes the changed posts and control values in one transaction.
+
+        If keys is given only those post ids / control keys are checked, deleted keys are removed from the store.
+        Entries another process changed are merged and the merge is taken over into db and control.
+        """
+        for key, entry in self.write(records.to_db(db, control, keys), keys).items():
+            records.apply(db, control, key, entry)
+
+    def stored_entry(self, key: str):
+        row = self.connection.execute("SELECT data FROM posts WHERE id = ? UNION ALL SELECT value FROM control WHERE key = ?", (key, key)).fetchone()
+        return row[0] if row != None else None
+
+    def write(self, db: dict, keys: list = None):
+        """Writes the changed entries of a db in the db.json layout
+
+        Args:
+            db (dict): The db in the db.json layout
+            keys (list): Only write these keys, missing ones are deleted
+
+        Returns:
+            dict: Key -> merged entry (None if deleted) for entries another process had changed
+        """
+        if keys == None:
+            keys = list(db.keys()) + [key for key in self.saved.keys() if not key in db.keys()]
+
+        changed = {}
+
+        for key in keys:
+            if not key in db.keys():
+                if key in self.saved.keys():
+                    changed[key] = None
+                continue
+
+            data = json.dumps(db[key])
+            if self.saved.get(key) != data:
+                changed[key] = data
+
+        if len(changed) == 0:
+            return {}
+
+        with self.connection:
+            # Holds the write lock from reading the stored rows until the commit
+            self.connection.execute("BEGIN IMMEDIATE")
+
+            # Nothing to merge if no other connection committed since this one last read everything
+            if self.connection.execute("PRAGMA data_version").fetchone()[0] == self.data_version:
+                merged = {}
+            else:
+                current = {key: self.stored_entry(key) for key in changed.keys()}
+                merged = reconcile(self.saved, db, current, changed.keys())
+            entries = {key: db.get(key) for key in changed.keys()} | merged
+
+            for key, entry in merged.items():
+                changed[key] = json.dumps(entry) if entry != None else None
+
+            for key, data in changed.items():
+                if data == None:
+                    self.connection.execute("DELETE FROM posts WHERE id = ?", (key,))
+                    self.connection.execute("DELETE FROM control WHERE key = ?", (key,))
+                elif isinstance(entries[key], dict) and not key in records.CONTROL_KEYS:
+                    # Upsert keeps the rowid, so posts load in the order they were first seen
+                    self.connection.execute("INSERT INTO posts (id, data, state, scheduled) VALUES (?, ?, ?, ?) "
+                                            "ON CONFLICT (id) DO UPDATE SET data = excluded.data, state = excluded.state, scheduled = excluded.scheduled",
+                                            (key, data, post_state(entries[key]), post_scheduled(entries[key])))
+                else:
+                    self.connection.execute("INSERT INTO control (key, value) VALUES (?, ?) "
+                                            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                                            (key, data))
+
+        for key, data in changed.items():
+            if data == None:
+                self.saved.pop(key, None)
+            else:
+                self.saved[key] = data
+
+        logging.debug(f"Saved {len(changed)} changed db entries")
+
+        return merged
+
+    def lock(self, duty: str):
+        """
+        Non-blocking lock that keeps a duty from running in two processes at once, see file_lock
+        """
+        if self.filename == ":memory:":
+            return contextlib.nullcontext(True)
+
+        return file_lock(f"{self.filename}.{duty}.lock", blocking = False)
+
+    def close(self):
+        self.connection.close()
+
+def open_store(backend: str, filename: str, legacy_json: str = "db.json", blob_dir: str = "blobs"):
+    """Opens the configured storage backend
+
+    Args:
+        backend (str): "sqlite" or "json"
+        filename (str): The db file
+        legacy_json (str): Old JSON db that gets migrated into a new SQLite db
+        blob_dir (str): Directory of the post bodies
+
+    Returns:
+        JSONStore or SQLiteStore: The store
+    """
+    blobs = BlobStore(blob_dir)
+
+    if backend == "json":
+        return JSONStore(filename, blobs)
+    if backend == "sqlite":
+        return SQLiteStore(filename, blobs, legacy_json)
+
+    raise ValueError(f"Unknown storage backend: {backend}")